@@ -0,0 +1,211 @@
+import gzip
+import hashlib
+import io
+import os
+import re
+import shutil
+import time
+
+import linking
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ASSETS_VERSION = 3
+PRECOMPRESS_EXTENSIONS = [".svg", ".css", ".js", ".json", ".html", ".txt", ".xml", ".ico", ".webmanifest"]
+PRECOMPRESS_MIN_SIZE = 256
+PRECOMPRESSED_VARIANTS = [".gz", ".br"]
+SVG_COMMENT_PATTERN = re.compile(rb"<!--.*?-->", re.DOTALL)
+SVG_METADATA_PATTERN = re.compile(rb"<metadata\b.*?</metadata>", re.DOTALL)
+SVG_LINE_BREAK_PATTERN = re.compile(rb">\s*\n\s*<")
+SVG_TEXT_PATTERN = re.compile(rb"<text\b.*?</text>", re.DOTALL)
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Chunks that Pillow writes back when it saves a PNG. Anything else, like the
+# acTL and fcTL chunks of an animated PNG or text and timestamp chunks, would
+# be lost, so such PNGs are left as they are.
+PNG_RECOMPRESSIBLE_CHUNKS = {b"IHDR", b"PLTE", b"tRNS", b"iCCP", b"IDAT", b"IEND"}
+
+
+def minify_svg(data):
+    """
+    Removes comments, `<metadata>` and the indentation between tags from an SVG. Whitespace inside `<text>` elements is left alone, since it separates the words of the text.
+    """
+    data = SVG_COMMENT_PATTERN.sub(b"", data)
+    data = SVG_METADATA_PATTERN.sub(b"", data)
+    text_spans = [match.span() for match in SVG_TEXT_PATTERN.finditer(data)]
+
+    def remove_line_break(match):
+        whitespace_start = match.start() + 1
+        if any(start <= whitespace_start < end for start, end in text_spans):
+            return match.group(0)
+        return b"><"
+
+    return SVG_LINE_BREAK_PATTERN.sub(remove_line_break, data).strip() + b"\n"
+
+
+def png_chunks(data):
+    """
+    Returns the chunk types of a PNG, or `None` if `data` is not a well-formed PNG.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    chunks = []
+    position = len(PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length = int.from_bytes(data[position:position + 4], "big")
+        chunks.append(data[position + 4:position + 8])
+        position += 12 + length
+    return chunks if position == len(data) else None
+
+
+def png_is_recompressible(data):
+    """
+    Checks that Pillow can rewrite a PNG without losing anything: it must have 8 bits per sample, so that no 16-bit or packed low-depth image is converted, and only the chunks in `PNG_RECOMPRESSIBLE_CHUNKS`, so that no animation or metadata is dropped.
+    """
+    chunks = png_chunks(data)
+    return (
+        chunks is not None
+        and chunks[:1] == [b"IHDR"]
+        and data[24] == 8
+        and set(chunks) <= PNG_RECOMPRESSIBLE_CHUNKS
+    )
+
+
+def recompress_png(data):
+    """
+    Recompresses a PNG losslessly with Pillow's optimizer, keeping its colour profile. Returns `data` unchanged if Pillow is not installed, or if rewriting the PNG with Pillow could lose anything, see `png_is_recompressible()`.
+
+    Pillow is imported here rather than at the top, since most builds have no new PNGs to recompress.
+    """
+    if not png_is_recompressible(data):
+        return data
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    with Image.open(io.BytesIO(data)) as image:
+        output = io.BytesIO()
+        image.save(output, format="PNG", optimize=True, icc_profile=image.info.get("icc_profile"))
+    return output.getvalue()
+
+
+def optimise(path, data):
+    """
+    Returns the optimised content of the static file `path`, or `data` itself if it can not be made smaller.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".svg":
+        optimised = minify_svg(data)
+    elif extension == ".png":
+        optimised = recompress_png(data)
+    else:
+        return data
+    return optimised if len(optimised) < len(data) else data
+
+
+def precompress(path, data):
+    """
+    Returns `{extension: content}` for the `.gz` and, if the brotli package is installed, `.br` variants of `data` that nginx `gzip_static` and `brotli_static` can serve directly. Variants that save less than a tenth of the size are left out.
+    """
+    if os.path.splitext(path)[1].lower() not in PRECOMPRESS_EXTENSIONS or len(data) < PRECOMPRESS_MIN_SIZE:
+        return {}
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {
+        extension: compressed
+        for extension, compressed in variants.items()
+        if len(compressed) < len(data) * 0.9
+    }
+
+
+def hashed_path(path, output_hash):
+    """
+    Inserts the start of `output_hash` before the extension of `path`, like `images/logo.3f2a1b9c0d.svg`.
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.{output_hash[:10]}{extension}"
+
+
+def output_hash(source_path, source_hash, cache_dir):
+    """
+    Returns the SHA-256 of the optimised file that is served for `source_path`. Content-hashed names use it rather than the source hash, so that the name changes whenever the served content does, also when only the optimiser changed.
+    """
+    try:
+        with open(cache_path(cache_dir, source_hash), "rb") as file:
+            data = file.read()
+    except FileNotFoundError:
+        data = process_asset(source_path, source_hash, cache_dir)[""]
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_path(cache_dir, source_hash, variant=""):
+    return os.path.join(cache_dir, "assets", f"{ASSETS_VERSION}-{source_hash}", f"asset{variant}")
+
+
+def process_asset(source_path, source_hash, cache_dir):
+    """
+    Returns `{variant: content}`, where the variant `""` is the optimised file and the others are its precompressed siblings. Results are cached in `cache_dir` by `source_hash`, so every version of a file is only optimised and compressed once.
+    """
+    directory = os.path.dirname(cache_path(cache_dir, source_hash))
+    if os.path.isdir(directory):
+        variants = {}
+        for filename in os.listdir(directory):
+            with open(os.path.join(directory, filename), "rb") as file:
+                variants[filename[len("asset"):]] = file.read()
+        if "" in variants:
+            return variants
+    with open(source_path, "rb") as file:
+        data = optimise(source_path, file.read())
+    variants = {"": data, **precompress(source_path, data)}
+    temporary_directory = f"{directory}.tmp{os.getpid()}"
+    os.makedirs(temporary_directory, exist_ok=True)
+    for variant, content in variants.items():
+        with open(os.path.join(temporary_directory, f"asset{variant}"), "wb") as file:
+            file.write(content)
+        shutil.copymode(source_path, os.path.join(temporary_directory, f"asset{variant}"))
+    try:
+        os.rename(temporary_directory, directory)
+    except OSError:
+        shutil.rmtree(temporary_directory)
+    return variants
+
+
+def write_bytes_if_changed(path, content):
+    try:
+        with open(path, "rb") as file:
+            if file.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    linking.write_atomically(path, content)
+    return True
+
+
+def build_asset(source_path, build_file_path, source_hash, cache_dir, hashed_build_file_path=None, link_mode="copy"):
+    """
+    Writes the optimised static file and its precompressed siblings to `build_file_path`, and also to `hashed_build_file_path` if given. Returns `(changed, size, seconds)` like `build_website.build_file()`.
+
+    If `link_mode` is not "copy", the files are linked from the cache instead, so that every build of the same file shares one copy.
+    """
+    start = time.perf_counter()
+    variants = process_asset(source_path, source_hash, cache_dir)
+    changed = False
+    for path in [build_file_path, hashed_build_file_path]:
+        if path is None:
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for variant, content in variants.items():
+            if link_mode != "copy":
+                changed = linking.link_or_copy(cache_path(cache_dir, source_hash, variant), f"{path}{variant}", link_mode) or changed
+                continue
+            changed = write_bytes_if_changed(f"{path}{variant}", content) or changed
+            shutil.copymode(source_path, f"{path}{variant}")
+        for variant in PRECOMPRESSED_VARIANTS:
+            if variant not in variants and os.path.exists(f"{path}{variant}"):
+                os.remove(f"{path}{variant}")
+                changed = True
+    return changed, len(variants[""]), time.perf_counter() - start
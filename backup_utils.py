@@ -0,0 +1,439 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+CHUNK_SIZE = 1 << 20
+MEDIA_CHUNK_SIZE = 4 << 20
+COMPRESSION_EXTENSIONS = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+    "none": "",
+}
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+PG_DUMP_CUSTOM_MAGIC = b"PGDMP"
+BACKUP_FORMATS = ["plain", "custom", "directory"]
+
+
+def detect_backup_format(path):
+    """
+    Tells a Postgres directory format dump, a custom format dump and a plain SQL script (compressed or not) apart.
+    """
+    if os.path.isdir(path):
+        if not os.path.isfile(os.path.join(path, "toc.dat")):
+            raise ValueError(f"{path} is a directory, but not a Postgres directory format dump")
+        return "directory"
+    with open(path, "rb") as file:
+        if file.read(len(PG_DUMP_CUSTOM_MAGIC)) == PG_DUMP_CUSTOM_MAGIC:
+            return "custom"
+    return "plain"
+
+
+def default_compression():
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def compression_from_path(path):
+    for compression, extension in COMPRESSION_EXTENSIONS.items():
+        if extension and path.endswith(extension):
+            return compression
+    return None
+
+
+def backup_path_with_extension(path, compression):
+    """
+    Appends the file extension of `compression` to `path` unless it is already there.
+    """
+    extension = COMPRESSION_EXTENSIONS[compression]
+    if path.endswith(extension):
+        return path
+    return f"{path}{extension}"
+
+
+def checksum_path(path):
+    return f"{path.rstrip(os.sep)}.sha256"
+
+
+def remove_backup_file(path):
+    """
+    Removes a partially written backup file and its checksum, if they exist.
+    """
+    for file_path in [path, checksum_path(path)]:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+class Progress:
+    """
+    Prints the number of bytes processed and the throughput at most every `interval` seconds, and a percentage when `total` is known.
+    """
+    def __init__(self, description, total=None, interval=1):
+        self.description = description
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.start = time.monotonic()
+        self.last_print = self.start
+
+    def update(self, count):
+        self.done += count
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            self.print(end="\r")
+
+    def print(self, end="\n"):
+        elapsed = max(time.monotonic() - self.start, 1e-9)
+        line = f"{self.description}: {self.done / 1e6:.1f} MB"
+        if self.total:
+            line += f" of {self.total / 1e6:.1f} MB ({100 * self.done / self.total:.0f}%)"
+        line += f", {self.done / elapsed / 1e6:.1f} MB/s"
+        print(line, end=end, file=sys.stderr, flush=True)
+
+    def finish(self):
+        self.print()
+
+
+class HashingWriter:
+    """
+    File-like wrapper that hashes everything written through it.
+    """
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
+
+
+def check_compression(compression):
+    """
+    Raises a `RuntimeError` if `compression` can not be used, before anything is dumped or written.
+    """
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise RuntimeError(f"Unknown compression {compression}, use one of {', '.join(COMPRESSION_EXTENSIONS)}")
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError("zstd compression requires the zstandard package, install it with: python3 -m pip install zstandard")
+
+
+def open_compressor(file, compression):
+    check_compression(compression)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=file, mode="wb", compresslevel=6)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=3, threads=-1).stream_writer(file, closefd=False)
+    return None
+
+
+def open_decompressor(file):
+    """
+    Returns a readable file object with the decompressed content of `file`, detecting gzip and zstd from the magic bytes.
+    """
+    magic = file.peek(4)[:4] if hasattr(file, "peek") else b""
+    if magic.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(fileobj=file, mode="rb")
+    if magic.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise RuntimeError("This backup is zstd compressed, which requires the zstandard package: python3 -m pip install zstandard")
+        return zstandard.ZstdDecompressor().stream_reader(file, closefd=False)
+    return file
+
+
+def write_checksum(path, digest):
+    with open(checksum_path(path), "w") as file:
+        file.write(f"{digest}  {os.path.basename(path)}\n")
+
+
+def read_checksums(path):
+    """
+    Returns `{relative_path: digest}` from the checksum file of `path`, where a single file has the relative path of its own basename.
+    """
+    try:
+        with open(checksum_path(path), "r") as file:
+            lines = file.read().splitlines()
+    except FileNotFoundError:
+        return None
+    return {
+        relative_path: digest
+        for digest, relative_path in (line.split("  ", 1) for line in lines if line)
+    }
+
+
+def hash_file(path, progress=None):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            if progress is not None:
+                progress.update(len(chunk))
+    return sha256.hexdigest()
+
+
+def list_files(directory):
+    return sorted(
+        os.path.relpath(os.path.join(dirpath, filename), directory)
+        for dirpath, dirnames, filenames in os.walk(directory)
+        for filename in filenames
+    )
+
+
+def write_directory_checksums(directory):
+    """
+    Writes the SHA-256 of every file in `directory` next to it in `sha256sum` format, so that it can be checked with `cd directory && sha256sum -c ../directory.sha256`.
+    """
+    with open(checksum_path(directory), "w") as file:
+        for relative_path in list_files(directory):
+            file.write(f"{hash_file(os.path.join(directory, relative_path))}  {relative_path}\n")
+
+
+def stream_to_file(source, path, compression, description="Storing backup"):
+    """
+    Copies everything readable from `source` into `path` in chunks of `CHUNK_SIZE` bytes, compressed with `compression`, and writes the SHA-256 checksum of the stored file next to it in `sha256sum` format. If anything fails, the partial file is removed.
+    """
+    check_compression(compression)
+    progress = Progress(description)
+    try:
+        with open(path, "wb") as file:
+            hashing_file = HashingWriter(file)
+            compressor = open_compressor(hashing_file, compression)
+            destination = compressor or hashing_file
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                destination.write(chunk)
+                progress.update(len(chunk))
+            if compressor is not None:
+                compressor.close()
+        progress.finish()
+        write_checksum(path, hashing_file.hexdigest())
+    except BaseException:
+        remove_backup_file(path)
+        raise
+    return hashing_file.hexdigest()
+
+
+def verify_checksum(path):
+    """
+    Compares the file or directory `path` with the checksums stored next to it. Returns `None` if there are no stored checksums.
+    """
+    expected = read_checksums(path)
+    if expected is None:
+        return None
+    if os.path.isdir(path):
+        files = {relative_path: os.path.join(path, relative_path) for relative_path in list_files(path)}
+    else:
+        files = {os.path.basename(path): path}
+    if files.keys() != expected.keys():
+        return False
+    progress = Progress("Verifying checksum", total=sum(os.path.getsize(file_path) for file_path in files.values()))
+    matches = all(
+        hash_file(file_path, progress) == expected[relative_path]
+        for relative_path, file_path in files.items()
+    )
+    progress.finish()
+    return matches
+
+
+def stream_from_file(path, destination, description="Restoring backup"):
+    """
+    Decompresses `path` on the fly into the writable `destination` in chunks of `CHUNK_SIZE` bytes, without an intermediate uncompressed copy.
+    """
+    with open(path, "rb") as raw_file:
+        progress = Progress(description, total=os.path.getsize(path))
+        file = open_decompressor(raw_file)
+        for chunk in iter(lambda: file.read(CHUNK_SIZE), b""):
+            destination.write(chunk)
+            progress.update(raw_file.tell() - progress.done)
+        progress.finish()
+
+
+class ChunkStore:
+    """
+    Content-addressed store for incremental, deduplicated backups of a directory.
+
+    Files are split into chunks of `MEDIA_CHUNK_SIZE` bytes, and every chunk is stored once under its SHA-256 in `chunks/`, no matter how many files or snapshots contain it. A snapshot in `snapshots/` lists the size, mtime, mode and chunks of every file. Files with the same size and mtime as in the previous snapshot reuse its chunk list without being read.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        self.snapshots_dir = os.path.join(store_dir, "snapshots")
+        self.stored_bytes = 0
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def put_chunk(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary_path = f"{path}.tmp{os.getpid()}"
+            with open(temporary_path, "wb") as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+            self.stored_bytes += len(data)
+        return digest
+
+    def get_chunk(self, digest):
+        with open(self.chunk_path(digest), "rb") as file:
+            data = file.read()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Chunk {digest} in {self.chunks_dir} is corrupt")
+        return data
+
+    def snapshots(self):
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        return sorted(os.path.splitext(filename)[0] for filename in os.listdir(self.snapshots_dir) if filename.endswith(".json"))
+
+    def load_snapshot(self, name):
+        with open(os.path.join(self.snapshots_dir, f"{name}.json"), "r") as file:
+            return json.load(file)
+
+    def store_snapshot(self, source_dir):
+        """
+        Stores a new snapshot of `source_dir` and returns its name.
+        """
+        snapshots = self.snapshots()
+        previous_files = self.load_snapshot(snapshots[-1])["files"] if snapshots else {}
+        self.stored_bytes = 0
+        files = {}
+        read_count = 0
+        progress = Progress("Storing media backup")
+        for relative_path in list_files(source_dir):
+            path = os.path.join(source_dir, relative_path)
+            previous = previous_files.get(relative_path)
+            try:
+                stat = os.stat(path)
+                if (
+                    previous is not None
+                    and (previous["size"], previous["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns)
+                    and all(os.path.exists(self.chunk_path(digest)) for digest in previous["chunks"])
+                ):
+                    chunks = previous["chunks"]
+                else:
+                    read_count += 1
+                    with open(path, "rb") as file:
+                        chunks = [self.put_chunk(chunk) for chunk in iter(lambda: file.read(MEDIA_CHUNK_SIZE), b"")]
+                    progress.update(stat.st_size)
+            except FileNotFoundError:
+                # Deleted after it was listed, so it is simply not part of this snapshot.
+                continue
+            files[relative_path] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "mode": stat.st_mode & 0o7777,
+                "chunks": chunks,
+            }
+        progress.finish()
+        name = time.strftime("%Y-%m-%dT%H-%M-%S")
+        if name in snapshots:
+            name = f"{name}-{len(snapshots)}"
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        temporary_path = os.path.join(self.snapshots_dir, f".{name}.json.tmp")
+        with open(temporary_path, "w") as file:
+            json.dump({"source_dir": os.path.abspath(source_dir), "files": files}, file)
+        os.replace(temporary_path, os.path.join(self.snapshots_dir, f"{name}.json"))
+        print(f"Snapshot {name}: {len(files)} files, {read_count} of them read, {self.stored_bytes / 1e6:.1f} MB of new data stored")
+        return name
+
+    def restore_snapshot(self, name, target_dir):
+        """
+        Recreates every file in snapshot `name` in `target_dir`, with its mtime and mode. Files in `target_dir` that are already identical to the snapshot are left alone.
+        """
+        files = self.load_snapshot(name)["files"]
+        progress = Progress("Restoring media backup", total=sum(entry["size"] for entry in files.values()))
+        for relative_path, entry in files.items():
+            path = os.path.join(target_dir, relative_path)
+            try:
+                stat = os.stat(path)
+                unchanged = (stat.st_size, stat.st_mtime_ns) == (entry["size"], entry["mtime_ns"])
+            except FileNotFoundError:
+                unchanged = False
+            if not unchanged:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "wb") as file:
+                    for digest in entry["chunks"]:
+                        file.write(self.get_chunk(digest))
+                os.chmod(path, entry["mode"])
+                os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            progress.update(entry["size"])
+        progress.finish()
+        print(f"Restored {len(files)} files from snapshot {name} into {target_dir}")
+
+    def delete_snapshot(self, name):
+        os.remove(os.path.join(self.snapshots_dir, f"{name}.json"))
+
+    def collect_garbage(self):
+        """
+        Deletes every chunk that no snapshot refers to anymore, and returns the number of bytes freed.
+        """
+        referenced = {
+            digest
+            for name in self.snapshots()
+            for entry in self.load_snapshot(name)["files"].values()
+            for digest in entry["chunks"]
+        }
+        freed = 0
+        if not os.path.isdir(self.chunks_dir):
+            return freed
+        for relative_path in list_files(self.chunks_dir):
+            if os.path.basename(relative_path) not in referenced:
+                path = os.path.join(self.chunks_dir, relative_path)
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H-%M-%S"
+RETENTION_TIERS = {
+    "hourly": "%Y-%m-%dT%H",
+    "daily": "%Y-%m-%d",
+    "weekly": "%G-W%V",
+}
+
+
+def parse_timestamp(name):
+    """
+    Returns the time a backup or snapshot named `name` was made, or `None` if `name` does not start with a timestamp in `TIMESTAMP_FORMAT`.
+    """
+    try:
+        return time.strptime(name[:19], TIMESTAMP_FORMAT)
+    except ValueError:
+        return None
+
+
+def backups_to_keep(names, retention):
+    """
+    Selects which of the timestamped backups `names` to keep, given `retention` as `{tier: count}` for the tiers in `RETENTION_TIERS`.
+
+    For every tier the newest backup in each of the `count` newest hours, days or weeks that have backups is kept, so a backup can be kept by several tiers. Names without a timestamp are always kept.
+    """
+    timestamps = {name: parse_timestamp(name) for name in names}
+    keep = {name for name, timestamp in timestamps.items() if timestamp is None}
+    newest_first = sorted((name for name in names if name not in keep), key=lambda name: (timestamps[name], name), reverse=True)
+    for tier, count in retention.items():
+        periods = set()
+        for name in newest_first:
+            period = time.strftime(RETENTION_TIERS[tier], timestamps[name])
+            if period in periods:
+                continue
+            if len(periods) >= count:
+                break
+            periods.add(period)
+            keep.add(name)
+    return keep
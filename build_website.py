@@ -1,12 +1,36 @@
 #!/usr/bin/python3
 
+import collections.abc
+import concurrent.futures
+import contextlib
+import filecmp
+import io
+import json
 import os
 import subprocess
+import sys
 import shutil
 import argparse
 import tomlkit
 import re
 import plac
+import time
+
+import assets
+import config_schema
+import linking
+from variable_index import CACHE_DIR, TEMPLATE_EXTENSIONS, VARIABLE_MARKER, VARIABLE_PATTERN, VariableIndex, default_index_path
+
+
+MANIFEST_FILENAME = ".mytaktlausvev_manifest.json"
+MANIFEST_VERSION = 3
+
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
 
 
 class TomlDict:
@@ -69,54 +93,457 @@ class TomlDict:
     def get_tomlkit_document(self):
         return self.raw_dict
 
+    def snapshot(self):
+        def recurse(raw_dict, prefix):
+            tomlkit_table_types = [tomlkit.items.Table, tomlkit.container.OutOfOrderTableProxy]
+            for key in raw_dict:
+                value = raw_dict[key]
+                if type(value) in tomlkit_table_types:
+                    yield from recurse(value, f"{prefix}{key}.")
+                else:
+                    yield f"{prefix}{key}", value.unwrap() if isinstance(value, tomlkit.items.Item) else value
+        return ConfigSnapshot(recurse(self.raw_dict, ""))
+
 
-def build_website(config_files, clean=False):
-    website_source_dir = os.path.join(os.path.dirname(__file__), "website_source")
-    website_build_dir = os.path.join(os.path.dirname(__file__), "website_build")
-    static_files_dir = os.path.join(os.path.dirname(__file__), "static_files")
+class ConfigSnapshot(collections.abc.Mapping):
+    """
+    Immutable, flattened copy of a `TomlDict`, mapping every dotted key straight to its plain Python value.
 
-    if clean:
-        if os.path.exists(website_build_dir):
-            shutil.rmtree(website_build_dir)
+    Lookups and membership tests are single dict operations instead of walks through the nested tomlkit tables. Use `TomlDict` for editing and serialisation, and take a snapshot once the config is final.
+    """
+    def __init__(self, items):
+        self.values = dict(items)
 
-    shutil.copytree(website_source_dir, website_build_dir, dirs_exist_ok=True)
+    def __getitem__(self, key):
+        return self.values[key]
 
-    shutil.copytree(static_files_dir, os.path.join(website_build_dir, "site/static"), dirs_exist_ok=True)
+    def __contains__(self, key):
+        return key in self.values
 
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+
+def render_template(template, config, markers=None, verbose=False):
+    """
+    Replaces every `(MYTAKTLAUSVEV_VARIABLE(config_variable))` in `template` with the value of `config_variable` in `config`.
+
+    The template is scanned once from start to end, and the result is written to a buffer instead of being rebuilt for every replacement. Templates without any marker are returned as they are without running the regex at all. When `markers` is given as `[start, end, variable]` offsets from a `VariableIndex`, the build jumps straight to them instead of scanning. Every replacement is printed when `verbose` is set.
+    """
+    if markers is None:
+        if VARIABLE_MARKER not in template:
+            return template
+        markers = (
+            (match.start(), match.end(), match.group(1))
+            for match in VARIABLE_PATTERN.finditer(template)
+        )
+    elif not markers:
+        return template
+    build = io.StringIO()
+    position = 0
+    for start, end, variable in markers:
+        replacement = config[variable] if variable in config else ""
+        if verbose:
+            print("Replacing", variable, "with", replacement)
+        build.write(template[position:start])
+        build.write(str(replacement))
+        position = end
+    build.write(template[position:])
+    return build.getvalue()
+
+
+def resolve_variable(config, variable):
+    return str(config[variable]) if variable in config else ""
+
+
+def load_config(config_files):
     config = TomlDict({})
     for config_file in config_files:
         with open(config_file, "r") as file:
             config.update(TomlDict(tomlkit.load(file)))
-    
+    return config
+
+
+def list_build_files(website_source_index, static_files_index):
+    """
+    Returns a dict mapping paths relative to `website_build` to the `(index, path)` of the source files they are built from.
+
+    Files in `static_files` take priority over files in `website_source` with the same build path.
+    """
+    build_files = {}
+    for index, build_subdir in [(website_source_index, ""), (static_files_index, "site/static")]:
+        for path in index:
+            build_files[os.path.join(build_subdir, path)] = (index, path)
+    return build_files
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path, "r") as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest["files"]
+
+
+def save_manifest(manifest_path, files):
+    write_if_changed(manifest_path, json.dumps({"version": MANIFEST_VERSION, "files": files}, indent=4, sort_keys=True))
+
+
+def is_up_to_date(entry, source_hash, config, build_file_path, asset=None, link_mode="copy"):
+    return (
+        entry is not None
+        and entry["hash"] == source_hash
+        and entry.get("asset") == asset
+        and entry.get("link_mode", "copy") == link_mode
+        and os.path.exists(build_file_path)
+        and all(
+            resolve_variable(config, variable) == value
+            for variable, value in entry["variables"].items()
+        )
+    )
+
+
+def manifest_outputs(build_path, entry):
+    """
+    Returns the paths, relative to `website_build`, of every file built for the manifest entry of `build_path`: the file itself and, for static assets, its precompressed siblings and content-hashed copies.
+    """
+    asset = entry.get("asset")
+    if asset is None:
+        return {build_path}
+    paths = [build_path]
+    if asset[1] is not None:
+        paths.append(os.path.join("site/static", asset[1]))
+    return {f"{path}{variant}" for path in paths for variant in ["", *assets.PRECOMPRESSED_VARIANTS]}
+
+
+def remove_stale_outputs(website_build_dir, manifest, new_manifest):
+    """
+    Deletes the files that the previous build made for `manifest` and the current build no longer makes for `new_manifest`, like outputs of deleted sources and old content-hashed names. Only files listed in a manifest are touched. Returns how many files were deleted.
+    """
+    def outputs(files):
+        return set().union(*(manifest_outputs(build_path, entry) for build_path, entry in files.items()))
+
+    removed = 0
+    for path in sorted(outputs(manifest) - outputs(new_manifest)):
+        file_path = os.path.join(website_build_dir, path)
+        if not os.path.lexists(file_path):
+            continue
+        os.remove(file_path)
+        removed += 1
+        directory = os.path.dirname(file_path)
+        while os.path.abspath(directory) != os.path.abspath(website_build_dir) and not os.listdir(directory):
+            os.rmdir(directory)
+            directory = os.path.dirname(directory)
+    return removed
+
+
+def write_if_changed(path, content):
+    """
+    Writes `content` to `path` unless the file already has exactly that content, in which case it is left alone with its mtime intact. Returns whether the file was written.
+
+    The new content is written to a temporary file that replaces `path`, since `path` may be linked to a source file by an earlier build.
+    """
+    try:
+        with open(path, "r") as file:
+            if file.read() == content:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    linking.write_atomically(path, content)
+    return True
+
+
+def copy_if_changed(source_path, destination_path):
+    """
+    Like `shutil.copy2()`, but leaves `destination_path` alone if it already has the same content as `source_path`. Returns whether the file was copied.
+    """
+    if os.path.isfile(destination_path) and filecmp.cmp(source_path, destination_path, shallow=False):
+        return False
+    linking.replace_atomically(destination_path, lambda temporary: shutil.copy2(source_path, temporary))
+    return True
+
+
+def build_file(source_path, build_file_path, markers, config, verbose=False, link_mode="copy"):
+    """
+    Copies `source_path` to `build_file_path`, rendering it on the way if it is a template with the marker offsets in `markers`. Returns `(changed, size, seconds)`.
+
+    Files without markers are reflinked or hardlinked instead of copied if `link_mode` is not "copy", see `linking.link_or_copy()`.
+    """
+    start = time.perf_counter()
+    os.makedirs(os.path.dirname(build_file_path), exist_ok=True)
+    _, extension = os.path.splitext(source_path)
+    if not markers and link_mode != "copy":
+        changed = linking.link_or_copy(source_path, build_file_path, link_mode)
+        return changed, os.path.getsize(build_file_path), time.perf_counter() - start
+    if extension not in TEMPLATE_EXTENSIONS:
+        changed = copy_if_changed(source_path, build_file_path)
+    else:
+        with open(source_path, "r") as file:
+            template = file.read()
+        changed = write_if_changed(build_file_path, render_template(template, config, markers, verbose))
+    shutil.copymode(source_path, build_file_path)
+    return changed, os.path.getsize(build_file_path), time.perf_counter() - start
+
+
+def build_pending_file(source_path, build_file_path, markers, asset, config, verbose=False, link_mode="copy"):
+    """
+    Builds a file planned by `build_website()`, through the static asset stage in `assets.py` if `asset` is given as `(source_hash, cache_dir, hashed_build_file_path)`.
+    """
+    if asset is not None:
+        return assets.build_asset(source_path, build_file_path, *asset, link_mode=link_mode)
+    return build_file(source_path, build_file_path, markers, config, verbose, link_mode)
+
+
+def static_asset_paths(static_files_index, hash_static_files, cache_dir=CACHE_DIR):
+    """
+    Returns `{path: hashed_path}` for the files in `static_files` that go through the static asset stage, which are the ones without config variable markers. `hashed_path` is `None` unless `hash_static_files` is set, and is named after the hash of the optimised file.
+    """
+    return {
+        path: assets.hashed_path(path, assets.output_hash(
+            os.path.join(static_files_index.root_dir, path),
+            static_files_index.hash(path),
+            cache_dir,
+        )) if hash_static_files else None
+        for path in static_files_index
+        if not static_files_index.markers(path)
+    }
+
+
+def with_hashed_static_paths(config, asset_paths):
+    """
+    Returns `config` with every value that is the path of a static asset replaced by its content-hashed path, so that templates link to the hashed files.
+    """
+    hashed_paths = {path: hashed for path, hashed in asset_paths.items() if hashed is not None}
+    if not hashed_paths:
+        return config
+    return ConfigSnapshot(
+        (key, hashed_paths.get(value, value) if isinstance(value, str) else value)
+        for key, value in config.items()
+    )
+
+
+worker_config = None
+worker_verbose = False
+worker_link_mode = "copy"
+
+
+def init_worker(config, verbose, link_mode):
+    global worker_config, worker_verbose, worker_link_mode
+    worker_config = config
+    worker_verbose = verbose
+    worker_link_mode = link_mode
+
+
+def build_file_in_worker(arguments):
+    return build_pending_file(*arguments, worker_config, worker_verbose, worker_link_mode)
+
+
+def build_files(pending, config, jobs, verbose=False, link_mode="copy"):
+    """
+    Builds every `(source_path, build_file_path, markers, asset)` in `pending` and returns `(changed, size, seconds)` for each of them.
+
+    With `jobs` above 1 the files are built in a process pool. The config snapshot is handed to every worker once when it starts.
+    """
+    if jobs <= 1 or len(pending) <= 1:
+        return [build_pending_file(*arguments, config, verbose, link_mode) for arguments in pending]
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(config, verbose, link_mode),
+    ) as executor:
+        return list(executor.map(
+            build_file_in_worker,
+            pending,
+            chunksize=max(1, len(pending) // (jobs * 4)),
+        ))
+
+
+class BuildReport:
+    """
+    Collects wall times per build phase and size, marker count and render time per built file.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.files = []
+        self.up_to_date_count = 0
+        self.removed_count = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def add_file(self, build_path, marker_count, changed, size, seconds):
+        self.files.append({
+            "path": build_path,
+            "markers": marker_count,
+            "changed": changed,
+            "bytes": size,
+            "seconds": seconds,
+        })
 
-    for dirpath, dirnames, filenames in os.walk(website_build_dir):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            _, extension = os.path.splitext(filepath)
-            if extension in [".py", ".html", ".scss", ".js", ".md", ".conf", ".env", ".json"]:
-                with open(filepath, "r") as file:
-                    build = file.read()
-                while True:
-                    match = re.search(r"\(MYTAKTLAUSVEV_VARIABLE\((.+?)\)\)", build)
-                    if match is None:
-                        break
-                    variable = match.group(1)
-                    replacement = config[variable] if variable in config else ""
-                    print("Replacing", variable, "with", replacement)
-                    build = build[:match.start()] + replacement + build[match.end():]
-                with open(filepath, "w") as file:
-                    file.write(build)
+    def slowest_files(self, count):
+        return sorted(self.files, key=lambda file: file["seconds"], reverse=True)[:count]
+
+    def print_summary(self, slowest_count=5):
+        changed_count = sum(file["changed"] for file in self.files)
+        print(f"Built {len(self.files)} files, {changed_count} of them changed, {self.up_to_date_count} files were already up to date")
+        if self.removed_count:
+            print(f"Removed {self.removed_count} files that are no longer built")
+        for name, seconds in self.phases.items():
+            print(f"  {name:<20} {seconds * 1000:10.1f} ms")
+        if self.files:
+            print("Slowest files:")
+            for file in self.slowest_files(slowest_count):
+                print(f"  {file['seconds'] * 1000:8.1f} ms  {file['bytes']:>10} bytes  {file['markers']:>5} markers  {file['path']}")
+
+    def save(self, report_path):
+        with open(report_path, "w") as file:
+            json.dump({
+                "phases": self.phases,
+                "total_seconds": sum(self.phases.values()),
+                "built": len(self.files),
+                "changed": sum(file["changed"] for file in self.files),
+                "up_to_date": self.up_to_date_count,
+                "removed": self.removed_count,
+                "total_bytes": sum(file["bytes"] for file in self.files),
+                "total_markers": sum(file["markers"] for file in self.files),
+                "files": self.files,
+            }, file, indent=4)
+
+
+def build_website(
+    config_files,
+    clean=False,
+    jobs=1,
+    website_source_dir=r("website_source"),
+    static_files_dir=r("static_files"),
+    website_build_dir=r("website_build"),
+    verbose=False,
+    report_file=None,
+    cache_dir=CACHE_DIR,
+    hash_static_files=False,
+    link_mode="copy",
+    schema_file=config_schema.SCHEMA_FILE,
+):
+    manifest_path = os.path.join(website_build_dir, MANIFEST_FILENAME)
+    report = BuildReport()
+
+    with report.phase("config"):
+        config = load_config(config_files).snapshot()
+
+    with report.phase("scan website_source"):
+        website_source_index = VariableIndex(website_source_dir, default_index_path(website_source_dir, cache_dir)).refresh()
+    with report.phase("scan static_files"):
+        static_files_index = VariableIndex(static_files_dir, default_index_path(static_files_dir, cache_dir)).refresh()
+
+    if schema_file is not None:
+        with report.phase("validate config"):
+            config_schema.validate_config(
+                config,
+                config_schema.static_file_paths(static_files_index, website_source_index),
+                schema_file,
+                cache_dir,
+            )
+
+    if clean:
+        with report.phase("clean"):
+            if os.path.exists(website_build_dir):
+                shutil.rmtree(website_build_dir)
+
+    with report.phase("plan"):
+        asset_paths = static_asset_paths(static_files_index, hash_static_files, cache_dir)
+        config = with_hashed_static_paths(config, asset_paths)
+        manifest = load_manifest(manifest_path)
+        new_manifest = {}
+        pending = []
+        pending_build_paths = []
+        for build_path, (index, path) in list_build_files(website_source_index, static_files_index).items():
+            build_file_path = os.path.join(website_build_dir, build_path)
+            entry = manifest.get(build_path)
+            source_hash = index.hash(path)
+            asset = None
+            if index is static_files_index and path in asset_paths:
+                hashed_path = asset_paths[path]
+                asset = [assets.ASSETS_VERSION, hashed_path]
+            file_link_mode = "copy" if index.markers(path) else link_mode
+            if is_up_to_date(entry, source_hash, config, build_file_path, asset, file_link_mode):
+                new_manifest[build_path] = entry
+                continue
+            pending.append((
+                os.path.join(index.root_dir, path),
+                build_file_path,
+                index.markers(path),
+                None if asset is None else (
+                    source_hash,
+                    cache_dir,
+                    None if hashed_path is None else os.path.join(website_build_dir, "site/static", hashed_path),
+                ),
+            ))
+            pending_build_paths.append(build_path)
+            new_manifest[build_path] = {
+                "asset": asset,
+                "hash": source_hash,
+                "link_mode": file_link_mode,
+                "variables": {
+                    variable: resolve_variable(config, variable)
+                    for variable in index.variables(path)
+                },
+            }
+        report.up_to_date_count = len(new_manifest) - len(pending)
+
+    with report.phase("render and copy"):
+        results = build_files(pending, config, jobs, verbose, link_mode)
+    for build_path, (_, _, markers, _), result in zip(pending_build_paths, pending, results):
+        report.add_file(build_path, len(markers), *result)
+
+    with report.phase("remove stale files"):
+        report.removed_count = remove_stale_outputs(website_build_dir, manifest, new_manifest)
+
+    with report.phase("save"):
+        os.makedirs(website_build_dir, exist_ok=True)
+        save_manifest(manifest_path, new_manifest)
+        website_source_index.save()
+        static_files_index.save()
+
+    report.print_summary()
+    if report_file is not None:
+        report.save(report_file)
+    return report
 
 
 @plac.pos("main_config_file")
 @plac.opt("base_config_file", abbrev="b")
 @plac.opt("server_secrets_file", abbrev="s")
 @plac.flg("clean")
+@plac.opt("jobs", abbrev="j", type=int)
+@plac.flg("watch", abbrev="w")
+@plac.flg("poll")
+@plac.flg("verbose", abbrev="v")
+@plac.opt("report_file", abbrev="r")
+@plac.flg("hash_static_files", abbrev="H")
+@plac.opt("link_mode", abbrev="l", choices=linking.LINK_MODES)
 def build_website_cli(
     main_config_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.toml"),
     base_config_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "taktlausconfig.toml"),
     server_secrets_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "server_secrets.toml"),
     clean=False,
+    jobs=1,
+    watch=False,
+    poll=False,
+    verbose=False,
+    report_file=None,
+    hash_static_files=False,
+    link_mode="copy",
 ):
     """
     Config options will be merged, `base_config_file` takes the lowest priority and `server_secrets_file` takes the highest priority. `base_config_file` and `server_secrets_file` will be ignored if they don't exist.
@@ -136,6 +563,21 @@ def build_website_cli(
 
     Use custom base config file:
     ./build_website.py -b other_base_config.toml
+
+    Render files in 8 parallel processes:
+    ./build_website.py -j 8
+
+    Rebuild whenever website_source, static_files or a config file changes:
+    ./build_website.py --watch
+
+    Print every replacement and store phase and file timings as JSON:
+    ./build_website.py -v -r build_report.json
+
+    Give static files content-hashed names, and point config paths to them:
+    ./build_website.py -H
+
+    Reflink or hardlink the files without config variables instead of copying them:
+    ./build_website.py -l auto
     """
 
     config_files = [base_config_file]
@@ -146,7 +588,41 @@ def build_website_cli(
     if os.path.exists(server_secrets_file):
         config_files.append(server_secrets_file)
 
-    build_website(config_files, clean=clean)
+    try:
+        build_website(config_files, clean=clean, jobs=jobs, verbose=verbose, report_file=report_file, hash_static_files=hash_static_files, link_mode=link_mode)
+    except config_schema.ConfigError as exception:
+        print(exception)
+        sys.exit(1)
+
+    if watch:
+        watch_and_build(config_files, [base_config_file, main_config_file, server_secrets_file], jobs=jobs, poll=poll, verbose=verbose, hash_static_files=hash_static_files, link_mode=link_mode)
+
+
+def watch_and_build(config_files, watched_config_files, jobs=1, poll=False, verbose=False, hash_static_files=False, link_mode="copy"):
+    """
+    Rebuilds the website on every change to `website_source`, `static_files` or `watched_config_files`.
+
+    The builds are incremental, so only outputs whose source changed, or that reference a config variable whose value changed, are rendered again. Config files in `watched_config_files` that do not exist yet are picked up when they are created.
+    """
+    import watch
+
+    def rebuild(changed_paths):
+        print(f"Detected changes in {len(changed_paths)} file(s), rebuilding...")
+        config_files_now = [
+            config_file for config_file in watched_config_files
+            if config_file in config_files or os.path.exists(config_file)
+        ]
+        try:
+            build_website(config_files_now, jobs=jobs, verbose=verbose, hash_static_files=hash_static_files, link_mode=link_mode)
+        except Exception as exception:
+            print("Build failed:", exception)
+
+    print("Watching for changes, press Ctrl+C to stop")
+    watch.watch(
+        [r("website_source"), r("static_files"), *watched_config_files],
+        rebuild,
+        polling=poll,
+    )
 
 
 if __name__ == "__main__":
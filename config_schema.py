@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+import tomlkit
+
+from variable_index import CACHE_DIR
+
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+SCHEMA_FILE = r("taktlausconfig_schema.toml")
+VALIDATION_VERSION = 1
+VALIDATION_CACHE_FILENAME = "config_validation.json"
+VALIDATION_CACHE_SIZE = 32
+VARIABLE_TYPES = ["visible_text", "context_dependent", "color_code", "static_file_path", "domain", "email", "username"]
+
+
+class ConfigError(ValueError):
+    """
+    A config that does not match the schema. `errors` holds one message per invalid variable.
+    """
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("The config is not valid:\n" + "\n".join(f"  {error}" for error in errors))
+
+
+def is_valid_color_code(text):
+    return (
+        len(text) == 7
+        and text[0] == "#"
+        and all(
+            character in [str(decimal) for decimal in [*range(10), "a", "b", "c", "d", "e", "f"]]
+            for character in text[1:]
+        )
+    )
+
+
+def load_schema(schema_file=SCHEMA_FILE):
+    """
+    Returns `(text, {variable: type})` for the schema in `schema_file`, with nested tables flattened to dotted variable names. A type is one of `VARIABLE_TYPES`, or a list of the allowed values.
+    """
+    with open(schema_file, "r") as file:
+        text = file.read()
+
+    def recurse(table, prefix):
+        for key, value in table.items():
+            if isinstance(value, dict):
+                yield from recurse(value, f"{prefix}{key}.")
+            else:
+                yield f"{prefix}{key}", value
+
+    schema = dict(recurse(tomlkit.parse(text).unwrap(), ""))
+    for variable, variable_type in schema.items():
+        if not isinstance(variable_type, list) and variable_type not in VARIABLE_TYPES:
+            raise ValueError(f"{schema_file}: {variable} has the unknown type {variable_type!r}")
+    return text, schema
+
+
+def static_file_paths(static_files_index, website_source_index):
+    """
+    Returns every path a static file path variable can point to: the files in `static_files`, and the files in the `static` directories of the website source.
+    """
+    paths = set(static_files_index)
+    for path in website_source_index:
+        _, separator, static_path = path.partition("static/")
+        if separator and (path.startswith("static/") or "/static/" in path):
+            paths.add(static_path)
+    return paths
+
+
+def check_value(variable_type, value):
+    """
+    Returns why `value` is not a valid `variable_type`, or `None` if it is. Static file paths are checked by `validate_config()`, since they depend on the files and not only on the config.
+    """
+    if isinstance(variable_type, list):
+        if value not in variable_type:
+            return f"must be one of {', '.join(map(json.dumps, variable_type))}"
+        return None
+    if not isinstance(value, str):
+        return "must be a string"
+    if variable_type == "color_code" and not is_valid_color_code(value.lower()):
+        return "must be a hexadecimal RGB color code like #a50104"
+    if variable_type in ["domain", "email"]:
+        import validators
+        if getattr(validators, variable_type)(value) is not True:
+            return f"must be a valid {variable_type}"
+        if variable_type == "domain" and value.startswith("www."):
+            return "must be given without www."
+    if variable_type == "username" and re.fullmatch(r"[a-z]+", value) is None:
+        return "can only contain the lowercase letters a to z"
+    return None
+
+
+def load_validation_cache(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, VALIDATION_CACHE_FILENAME), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_validation_cache(cache, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, VALIDATION_CACHE_FILENAME)
+    with open(f"{path}.tmp{os.getpid()}", "w") as file:
+        json.dump(cache, file, indent=4)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def validate_config(config, static_paths, schema_file=SCHEMA_FILE, cache_dir=CACHE_DIR):
+    """
+    Checks every variable of the flat `config` that is in the schema against its type in one pass, and raises a `ConfigError` listing all invalid variables. Variables that are not set are not checked.
+
+    The type checks are cached in `cache_dir` by the hash of the config and the schema, so an unchanged config is not checked again. Static file paths are always checked against `static_paths`, since those files can change without the config changing.
+    """
+    schema_text, schema = load_schema(schema_file)
+    config_hash = hashlib.sha256(json.dumps(
+        [VALIDATION_VERSION, schema_text, sorted(config.items())],
+        default=str,
+    ).encode()).hexdigest()
+    cache = load_validation_cache(cache_dir)
+    errors = cache.get(config_hash)
+    if errors is None:
+        errors = []
+        for variable, variable_type in schema.items():
+            if variable in config:
+                error = check_value(variable_type, config[variable])
+                if error is not None:
+                    errors.append(f"{variable} = {json.dumps(config[variable], default=str)} {error}")
+        cache.pop(config_hash, None)
+        cache[config_hash] = errors
+        save_validation_cache(dict(list(cache.items())[-VALIDATION_CACHE_SIZE:]), cache_dir)
+    errors = errors + [
+        f"{variable} = {json.dumps(config[variable])} is not a file in static_files or a static directory of website_source"
+        for variable, variable_type in schema.items()
+        if variable_type == "static_file_path" and isinstance(config.get(variable), str) and config[variable] not in static_paths
+    ]
+    if errors:
+        raise ConfigError(errors)
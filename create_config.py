@@ -47,7 +47,7 @@ class HighLevelConfigEntry:
 def create_config(prompt_session: PromptSession, high_level_config_entries: list, store_as_default: str):
     toml_dict = TomlDict({})
     for entry in high_level_config_entries:
-        if entry.only_if and not entry.only_if(toml_dict):
+        if entry.only_if and not entry.only_if(toml_dict.snapshot()):
             continue
 
         if entry.help_text is not None:
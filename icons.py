@@ -0,0 +1,152 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import hashlib
+import io
+import os
+import plac
+
+from PIL import Image
+
+from assets import write_bytes_if_changed
+from variable_index import CACHE_DIR
+
+
+ICONS_VERSION = 1
+FAVICON_SIZES = [16, 32, 48]
+APPLE_TOUCH_ICON_SIZE = 180
+MANIFEST_ICON_SIZES = [192, 512]
+ICON_SIZES = sorted({*FAVICON_SIZES, APPLE_TOUCH_ICON_SIZE, *MANIFEST_ICON_SIZES})
+
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+def decode_source(source_path, data, size):
+    """
+    Decodes the logo once, with the largest side at least `size` pixels. SVGs are rendered with svglib at that size, so that they stay sharp.
+    """
+    if os.path.splitext(source_path)[1].lower() == ".svg":
+        from svglib.svglib import svg2rlg
+        from reportlab.graphics import renderPM
+        drawing = svg2rlg(io.BytesIO(data))
+        scale = size / max(drawing.width, drawing.height)
+        drawing.scale(scale, scale)
+        drawing.width *= scale
+        drawing.height *= scale
+        image = renderPM.drawToPIL(drawing)
+    else:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    return image.convert("RGBA")
+
+
+def render_icon(image, size):
+    """
+    Scales `image` to fit a transparent `size`x`size` square, centered, and returns it as PNG.
+    """
+    scale = size / max(image.size)
+    scaled = image.resize(
+        (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+        Image.Resampling.LANCZOS,
+    )
+    icon = Image.new("RGBA", (size, size), (0, 0, 0, 0))
+    icon.paste(scaled, ((size - scaled.width) // 2, (size - scaled.height) // 2))
+    output = io.BytesIO()
+    icon.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+
+def icon_cache_path(cache_dir, source_hash, size):
+    return os.path.join(cache_dir, "icons", f"{ICONS_VERSION}-{source_hash}", f"{size}.png")
+
+
+def render_icons(source_path, cache_dir=CACHE_DIR, jobs=None):
+    """
+    Returns `{size: png}` for every size in `ICON_SIZES`, cached in `cache_dir` by the hash of the logo and the size.
+
+    The logo is only decoded if a size is missing from the cache, and then only once for all the missing sizes, which are scaled in parallel threads.
+    """
+    with open(source_path, "rb") as file:
+        data = file.read()
+    source_hash = hashlib.sha256(data).hexdigest()
+    icons = {}
+    for size in ICON_SIZES:
+        try:
+            with open(icon_cache_path(cache_dir, source_hash, size), "rb") as file:
+                icons[size] = file.read()
+        except FileNotFoundError:
+            pass
+    missing = [size for size in ICON_SIZES if size not in icons]
+    if not missing:
+        return icons
+    image = decode_source(source_path, data, max(missing))
+    upscaled = [size for size in missing if size > max(image.size)]
+    if upscaled:
+        print(f"Warning: {source_path} is only {image.width}x{image.height} pixels, so the {', '.join(map(str, upscaled))} pixel icons are scaled up and will look blurry. Use a larger logo or an SVG.")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        for size, icon in zip(missing, executor.map(lambda size: render_icon(image, size), missing)):
+            icons[size] = icon
+            path = icon_cache_path(cache_dir, source_hash, size)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as file:
+                file.write(icon)
+    return icons
+
+
+def favicon(icons):
+    """
+    Packs the `FAVICON_SIZES` PNGs of `icons` into one `.ico` file.
+    """
+    images = [Image.open(io.BytesIO(icons[size])) for size in FAVICON_SIZES]
+    output = io.BytesIO()
+    images[-1].save(
+        output,
+        format="ICO",
+        sizes=[image.size for image in images],
+        append_images=images[:-1],
+    )
+    return output.getvalue()
+
+
+def generate_icons(logo_path, static_files_dir=r("static_files"), cache_dir=CACHE_DIR, jobs=None):
+    """
+    Generates a favicon, an Apple touch icon and the PWA manifest icons from `logo_path`, a path relative to `static_files_dir`, and stores them next to it.
+
+    Files that already have the right content are not rewritten, so an unchanged logo does not make the next build copy anything. Returns `{kind: path}` with paths relative to `static_files_dir`.
+    """
+    icons = render_icons(os.path.join(static_files_dir, logo_path), cache_dir, jobs)
+    stem = os.path.splitext(logo_path)[0]
+    outputs = {
+        "favicon": (f"{stem}-favicon.ico", favicon(icons)),
+        "apple_touch_icon": (f"{stem}-apple-touch-icon.png", icons[APPLE_TOUCH_ICON_SIZE]),
+        **{
+            f"manifest_icon_{size}": (f"{stem}-{size}.png", icons[size])
+            for size in MANIFEST_ICON_SIZES
+        },
+    }
+    for path, content in outputs.values():
+        write_bytes_if_changed(os.path.join(static_files_dir, path), content)
+    return {kind: path for kind, (path, _) in outputs.items()}
+
+
+@plac.pos("logo_path")
+@plac.opt("static_files_dir", abbrev="s")
+@plac.opt("jobs", abbrev="j", type=int)
+def generate_icons_cli(logo_path, static_files_dir=r("static_files"), jobs=None):
+    """
+    Generates icons in every size the website needs from a logo in `static_files_dir`.
+
+    Example usage:
+    ./icons.py images/taktlauslogo.svg
+    """
+    for kind, path in generate_icons(logo_path, static_files_dir, jobs=jobs).items():
+        print(f"{kind}: {path}")
+
+
+if __name__ == "__main__":
+    plac.call(generate_icons_cli)
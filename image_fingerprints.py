@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import subprocess
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+from build_website import MANIFEST_FILENAME
+from variable_index import CACHE_DIR, hash_file
+
+
+FINGERPRINTS_DIRNAME = "image_fingerprints"
+FILE_HASHES_DIRNAME = "context_hashes"
+
+
+def build_contexts(website_build_dir, compose_file, environment=None):
+    """
+    Returns `{service: (context_dir, build_config)}` for every service in `compose_file` that is built from a Dockerfile.
+
+    The contexts are read from `docker-compose config` with PyYAML if it is installed. Without it, every service is assumed to be built from all of `website_build_dir`, which only means that a change anywhere rebuilds all services.
+    """
+    result = subprocess.run(
+        ["docker-compose", "-f", compose_file, "config"],
+        cwd=website_build_dir,
+        env=environment,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    if result.returncode != 0:
+        return None
+    if yaml is None:
+        services = subprocess.run(
+            ["docker-compose", "-f", compose_file, "config", "--services"],
+            cwd=website_build_dir,
+            env=environment,
+            stdout=subprocess.PIPE,
+            text=True,
+        ).stdout.split()
+        return {service: (website_build_dir, result.stdout) for service in services}
+    contexts = {}
+    for service, service_config in yaml.safe_load(result.stdout).get("services", {}).items():
+        build = service_config.get("build")
+        if build is None:
+            continue
+        if isinstance(build, str):
+            build = {"context": build}
+        context_dir = os.path.join(website_build_dir, build.get("context", "."))
+        contexts[service] = (context_dir, json.dumps(build, sort_keys=True))
+    return contexts
+
+
+def file_hashes_path(context_dir, cache_dir=CACHE_DIR):
+    context_dir_hash = hashlib.sha256(os.path.abspath(context_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, FILE_HASHES_DIRNAME, f"{context_dir_hash}.json")
+
+
+def fingerprint_context(context_dir, build_config, cache_dir=CACHE_DIR):
+    """
+    Hashes the path, content and executable bit of every file in `context_dir` together with `build_config`. File contents are only rehashed when their size or mtime changed, through a cache of `{path: [size, mtime_ns, hash]}` for the context.
+    """
+    cache_path = file_hashes_path(context_dir, cache_dir)
+    try:
+        with open(cache_path, "r") as file:
+            cached = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached = {}
+    hashes = {}
+    sha256 = hashlib.sha256(build_config.encode())
+    for dirpath, dirnames, filenames in os.walk(context_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            path = os.path.relpath(file_path, context_dir)
+            if path == MANIFEST_FILENAME:
+                continue
+            stat = os.stat(file_path)
+            entry = cached.get(path)
+            if entry is None or entry[:2] != [stat.st_size, stat.st_mtime_ns]:
+                entry = [stat.st_size, stat.st_mtime_ns, hash_file(file_path)]
+            hashes[path] = entry
+            executable = stat.st_mode & 0o111 != 0
+            sha256.update(f"{path}\0{entry[2]}\0{executable}\n".encode())
+    if hashes != cached:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(f"{cache_path}.tmp{os.getpid()}", "w") as file:
+            json.dump(hashes, file)
+        os.replace(f"{cache_path}.tmp{os.getpid()}", cache_path)
+    return sha256.hexdigest()
+
+
+def fingerprints_path(key, cache_dir=CACHE_DIR):
+    key_hash = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, FINGERPRINTS_DIRNAME, f"{key_hash}.json")
+
+
+def load_fingerprints(key, cache_dir=CACHE_DIR):
+    try:
+        with open(fingerprints_path(key, cache_dir), "r") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_fingerprints(key, fingerprints, cache_dir=CACHE_DIR):
+    """
+    Stores the fingerprints of one compose file and project in a file of its own, so that sites that are provisioned in parallel never overwrite each other's fingerprints.
+    """
+    path = fingerprints_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp{os.getpid()}", "w") as file:
+        json.dump(fingerprints, file, indent=4, sort_keys=True)
+    os.replace(f"{path}.tmp{os.getpid()}", path)
+
+
+def build_changed_images(website_build_dir, compose_file="docker-compose.prod.yaml", cache_dir=CACHE_DIR, environment=None, force=False):
+    """
+    Runs `docker-compose build` for the services whose build context changed since their last successful build, and none at all if nothing changed. Returns the services that were built, or `None` if building failed.
+
+    The fingerprints only cover the build contexts, so `force` builds every service regardless and pulls newer versions of their base images. `environment` replaces the environment of docker-compose, for example to set `COMPOSE_PROJECT_NAME`.
+    """
+    contexts = build_contexts(website_build_dir, compose_file, environment)
+    if contexts is None:
+        print(f"Could not read {compose_file}, check it with: docker-compose -f {compose_file} config")
+        return None
+    key = os.path.join(os.path.abspath(website_build_dir), compose_file)
+    if environment is not None and "COMPOSE_PROJECT_NAME" in environment:
+        key = f"{key}:{environment['COMPOSE_PROJECT_NAME']}"
+    previous = load_fingerprints(key, cache_dir)
+    current = {
+        service: fingerprint_context(context_dir, build_config, cache_dir)
+        for service, (context_dir, build_config) in contexts.items()
+    }
+    changed = sorted(service for service, fingerprint in current.items() if force or previous.get(service) != fingerprint)
+    if not changed:
+        print("No images need to be rebuilt")
+        return changed
+    print(f"Building {', '.join(changed)}")
+    if subprocess.run(["docker-compose", "-f", compose_file, "build", *(["--pull"] if force else []), *changed], cwd=website_build_dir, env=environment).returncode != 0:
+        return None
+    save_fingerprints(key, current, cache_dir)
+    return changed
@@ -0,0 +1,82 @@
+import errno
+import fcntl
+import filecmp
+import os
+import shutil
+
+
+FICLONE = 0x40049409
+LINK_MODES = ["copy", "reflink", "hardlink", "auto"]
+UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS, errno.EMLINK}
+
+
+def temporary_path(path):
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp{os.getpid()}")
+
+
+def replace_atomically(path, write):
+    """
+    Calls `write(temporary_path)` and renames the result over `path`, so that `path` is never written in place. A build output that is a hardlink to its source is thereby replaced instead of changing the source through the shared inode.
+    """
+    temporary = temporary_path(path)
+    try:
+        write(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def write_atomically(path, content):
+    def write(temporary):
+        with open(temporary, "wb" if isinstance(content, bytes) else "w") as file:
+            file.write(content)
+    replace_atomically(path, write)
+
+
+def reflink(source_path, destination_path):
+    """
+    Makes `destination_path` a copy-on-write clone of `source_path` with the FICLONE ioctl, which Btrfs, XFS and some other Linux file systems support.
+    """
+    with open(source_path, "rb") as source, open(destination_path, "wb") as destination:
+        fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+    shutil.copystat(source_path, destination_path)
+
+
+def link_methods(link_mode):
+    if link_mode == "reflink":
+        return [reflink]
+    if link_mode == "hardlink":
+        return [os.link]
+    if link_mode == "auto":
+        return [reflink, os.link]
+    return []
+
+
+def link_or_copy(source_path, destination_path, link_mode):
+    """
+    Places `source_path` at `destination_path` as a reflink or hardlink, as chosen by `link_mode`, and falls back to a copy if the file system does not support it. "auto" tries a reflink first, since it is safe even when the source is edited in place later, and then a hardlink.
+
+    Returns whether the content at `destination_path` changed.
+    """
+    if os.path.isfile(destination_path) and os.path.samefile(source_path, destination_path):
+        return False
+    unchanged = os.path.isfile(destination_path) and filecmp.cmp(source_path, destination_path, shallow=False)
+    if unchanged and link_mode == "copy":
+        return False
+
+    def write(temporary):
+        for method in link_methods(link_mode):
+            try:
+                method(source_path, temporary)
+                return
+            except OSError as exception:
+                if exception.errno not in UNSUPPORTED_ERRNOS:
+                    raise
+                if os.path.lexists(temporary):
+                    os.remove(temporary)
+        shutil.copy2(source_path, temporary)
+
+    replace_atomically(destination_path, write)
+    return not unchanged
@@ -0,0 +1,145 @@
+import os
+import re
+import sys
+import time
+
+
+BLOCK_SIZE = 1 << 16
+MAX_LOG_BYTES = 10 << 20
+LOG_BACKUP_COUNT = 5
+
+
+def rotated_path(path, number):
+    return path if number == 0 else f"{path}.{number}"
+
+
+class RotatingLogWriter:
+    """
+    Appends to the log file `path`, and renames it to `path.1`, `path.1` to `path.2` and so on when it would grow beyond `max_bytes`. Only `backup_count` rotated files are kept.
+    """
+    def __init__(self, path, max_bytes=MAX_LOG_BYTES, backup_count=LOG_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = open(path, "ab")
+
+    def rotate(self):
+        self.file.close()
+        for number in range(self.backup_count, 0, -1):
+            if os.path.exists(rotated_path(self.path, number - 1)):
+                os.replace(rotated_path(self.path, number - 1), rotated_path(self.path, number))
+        self.file = open(self.path, "ab")
+
+    def write(self, data):
+        if self.file.tell() > 0 and self.file.tell() + len(data) > self.max_bytes:
+            self.rotate()
+        self.file.write(data)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def copy_to_log(source, path, max_bytes=MAX_LOG_BYTES, backup_count=LOG_BACKUP_COUNT):
+    """
+    Copies every line readable from the binary file `source` into the rotating log `path` until end of file.
+    """
+    writer = RotatingLogWriter(path, max_bytes, backup_count)
+    try:
+        for line in iter(source.readline, b""):
+            writer.write(line)
+    finally:
+        writer.close()
+
+
+def read_lines_backwards(path):
+    """
+    Yields the lines of `path` from the last to the first, reading blocks of `BLOCK_SIZE` bytes from the end, so that only as much of the file is read as is consumed.
+    """
+    with open(path, "rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        remainder = b""
+        while position > 0:
+            size = min(BLOCK_SIZE, position)
+            position -= size
+            file.seek(position)
+            lines = (file.read(size) + remainder).split(b"\n")
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line
+        yield remainder
+
+
+def log_line_matches(line, service=None, pattern=None):
+    """
+    Checks whether `line` comes from `service`, going by the `service_1  | ` prefix docker-compose writes, and matches the regular expression `pattern`.
+    """
+    if service is not None:
+        prefix, separator, _ = line.partition("|")
+        if not separator or service not in prefix:
+            return False
+    return pattern is None or re.search(pattern, line) is not None
+
+
+def tail_lines(path, count, service=None, pattern=None, backup_count=LOG_BACKUP_COUNT):
+    """
+    Returns the last `count` lines of the log `path` that match `service` and `pattern`, continuing into the rotated files if the current one has too few.
+    """
+    lines = []
+    for number in range(backup_count + 1):
+        try:
+            reversed_lines = read_lines_backwards(rotated_path(path, number))
+            for line in reversed_lines:
+                if len(lines) >= count:
+                    break
+                text = line.decode(errors="replace")
+                if text and log_line_matches(text, service, pattern):
+                    lines.append(text)
+        except FileNotFoundError:
+            break
+        if len(lines) >= count:
+            break
+    return lines[::-1]
+
+
+def follow_lines(path, service=None, pattern=None, interval=0.5):
+    """
+    Yields lines matching `service` and `pattern` as they are appended to the log `path`, starting at its current end and reopening it when it is rotated.
+    """
+    file = open(path, "rb")
+    file.seek(0, os.SEEK_END)
+    partial = b""
+    try:
+        while True:
+            data = file.readline()
+            if data:
+                partial += data
+                if partial.endswith(b"\n"):
+                    text = partial.decode(errors="replace").rstrip("\n")
+                    partial = b""
+                    if log_line_matches(text, service, pattern):
+                        yield text
+                continue
+            try:
+                rotated = os.stat(path).st_ino != os.fstat(file.fileno()).st_ino
+            except FileNotFoundError:
+                rotated = False
+            if rotated:
+                file.close()
+                file = open(path, "rb")
+                continue
+            time.sleep(interval)
+    finally:
+        file.close()
+
+
+def print_log(path, count=50, follow=False, service=None, pattern=None):
+    for line in tail_lines(path, count, service, pattern):
+        print(line)
+    if follow:
+        try:
+            for line in follow_lines(path, service, pattern):
+                print(line, flush=True)
+        except KeyboardInterrupt:
+            pass
+    sys.stdout.flush()
@@ -6,9 +6,16 @@ import subprocess
 import time
 import plac
 import re
+import shutil
+import signal
+import sys
+import traceback
 
-from build_website import build_website, build_website_cli
-from prompt_utils import create_prompt_session
+# build_website, image_fingerprints and prompt_utils load tomlkit, PyYAML and
+# prompt_toolkit, so they are imported in the functions that use them. That
+# keeps frequent calls like `prod.py status` down to the bare interpreter.
+import backup_utils
+import log_utils
 
 
 def r(*path):
@@ -26,63 +33,521 @@ def run_in_dir(directory, callable):
     return result
 
 
+def is_supervisor_process(process_id):
+    """
+    Checks in `/proc` that `process_id` runs `prod.py supervise`, so that a stale `prod.pid`, for example from before a reboot, never makes another process count as the server.
+    """
+    try:
+        with open(f"/proc/{process_id}/cmdline", "rb") as file:
+            arguments = file.read().split(b"\0")
+    except OSError:
+        return False
+    return any(os.path.basename(argument) == b"prod.py" for argument in arguments) and b"supervise" in arguments
+
+
+def process_is_alive(process_id):
+    """
+    Checks whether `process_id` is the server, still leading its own process group, which is how `prod_start()` starts it. Reaps the process first if it is a finished child of this process.
+    """
+    try:
+        os.waitpid(process_id, os.WNOHANG)
+    except ChildProcessError:
+        pass
+    try:
+        return os.getpgid(process_id) == process_id and is_supervisor_process(process_id)
+    except ProcessLookupError:
+        return False
+
+
+def remove_pidfile():
+    try:
+        os.remove(r("prod.pid"))
+    except FileNotFoundError:
+        pass
+
+
 def prod_get_process_id():
-    output = subprocess.run("screen -ls", shell=True, stdout=subprocess.PIPE).stdout.decode("UTF-8")
-    for line in output.split("\n"):
-        match = re.match(r".*?(\d+)\.mytaktlausvev_prod.*", line)
-        if match is None:
-            continue
-        (process_id,) = match.groups()
-        return process_id
-    return None
+    try:
+        with open(r("prod.pid"), "r") as file:
+            process_id = int(file.read())
+    except (FileNotFoundError, ValueError):
+        return None
+    if not process_is_alive(process_id):
+        remove_pidfile()
+        return None
+    return process_id
 
 
 def prod_is_running():
     return prod_get_process_id() is not None
 
 
+def prod_supervise():
+    """
+    Runs docker-compose and copies its output into the rotating log `prod_log.txt`. Started by `prod_start()` as the leader of the process group that `prod_stop()` signals, so it ignores SIGTERM and keeps logging until docker-compose has shut down.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    process = subprocess.Popen(
+        ["docker-compose", "-f", r("website_build/docker-compose.prod.yaml"), "up"],
+        cwd=r(),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    try:
+        log_utils.copy_to_log(process.stdout, r("prod_log.txt"))
+    finally:
+        process.stdout.close()
+    return process.wait()
+
+
 def prod_start():
-    log_file_path=r("prod_log.txt")
     if prod_is_running():
         print("Production server is already running")
         return
-    if os.path.exists(log_file_path):
-        os.remove(log_file_path)
-    subprocess.run(f"screen -dmS mytaktlausvev_prod -L -Logfile {log_file_path} docker-compose -f website_build/docker-compose.prod.yaml up --build --force-recreate", shell=True)
+    process = subprocess.Popen(
+        [sys.executable, r("prod.py"), "supervise"],
+        cwd=r(),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    with open(r("prod.pid"), "w") as file:
+        file.write(str(process.pid))
     print("Production server was started")
 
 
-def prod_stop():
+def wait_for_exit(process_id, timeout):
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while process_is_alive(process_id):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * 2, 1)
+    return True
+
+
+def prod_stop(timeout=60):
+    """
+    Asks the production server to shut down gracefully with SIGTERM, and kills its whole process group with SIGKILL if it has not exited within `timeout` seconds. The containers are then stopped with `docker-compose stop`, since killing docker-compose does not stop them.
+    """
     process_id = prod_get_process_id()
     if process_id is None:
         print("Production server is not running")
-    subprocess.run(f"kill {process_id}", shell=True)
-    if prod_is_running():
+        return
+    try:
+        os.killpg(process_id, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    if not wait_for_exit(process_id, timeout):
+        print(f"Production server did not stop within {timeout} seconds, killing it")
+        try:
+            os.killpg(process_id, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        wait_for_exit(process_id, 10)
+        # Killing docker-compose leaves the containers running, so they are
+        # stopped through the Docker daemon instead.
+        if docker_compose("stop").returncode != 0:
+            print("The containers could not be stopped, check them with: docker ps")
+            return
+    if process_is_alive(process_id):
         print("Production server was not stopped")
     else:
+        remove_pidfile()
         print("Production server was stopped")
 
 
-def prod_rebuild():
-    build_website_cli()
-    run_in_dir(
-        r("website_build"),
-        lambda: subprocess.run("docker-compose -f docker-compose.prod.yaml build", shell=True),
+def wait_until(check, description, timeout, give_up=None, max_delay=5):
+    """
+    Polls `check()` with exponential backoff until it returns `True`, `timeout` seconds have passed or `give_up()` returns `True`. Returns whether it succeeded.
+    """
+    start = time.monotonic()
+    delay = 0.25
+    while True:
+        if give_up is not None and give_up():
+            print(f"{description} stopped before it was ready")
+            return False
+        if check():
+            print(f"{description} is ready after {time.monotonic() - start:.1f} seconds")
+            return True
+        remaining = timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            print(f"{description} was not ready within {timeout} seconds")
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+
+
+def database_is_ready(docker_container):
+    """
+    Asks Postgres in `docker_container` whether it accepts connections. Connects over TCP, since the temporary server Postgres runs while initialising a new database only listens on its Unix socket.
+    """
+    return subprocess.run(
+        ["docker", "exec", docker_container, "pg_isready", "-h", "127.0.0.1", "-U", "taktlaus", "-d", "taktlaus_db"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    ).returncode == 0
+
+
+def http_is_ready(url):
+    """
+    Checks whether `url` answers with anything other than a server error, following redirects and accepting local HTTPS certificates.
+    """
+    import ssl
+    import urllib.error
+    import urllib.request
+
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    try:
+        with urllib.request.urlopen(url, timeout=5, context=context) as response:
+            return response.status < 500
+    except urllib.error.HTTPError as error:
+        return error.code < 500
+    except (urllib.error.URLError, OSError):
+        return False
+
+
+def wait_for_database(docker_container, timeout=120):
+    return wait_until(lambda: database_is_ready(docker_container), "Database", timeout)
+
+
+def wait_for_http(url="http://localhost/", timeout=600):
+    return wait_until(
+        lambda: http_is_ready(url),
+        "Production server",
+        timeout,
+        give_up=lambda: not prod_is_running(),
     )
+
+
+def prod_log(count=50, follow=False, service=None, pattern=None):
+    """
+    Prints the last `count` lines of the production log, only from `service` and matching the regular expression `pattern` if given, and keeps printing new lines with `follow`.
+    """
+    log_file_path = r("prod_log.txt")
+    if not os.path.exists(log_file_path):
+        print(f"There is no log in {log_file_path} yet")
+        return
+    log_utils.print_log(log_file_path, int(count), follow, service, pattern)
+
+
+def prod_wait_ready(url="http://localhost/", docker_container=None, timeout=600):
+    """
+    Waits until the production server answers on `url`, and the database in `docker_container` accepts connections if given.
+    """
+    timeout = float(timeout)
+    start = time.monotonic()
+    if docker_container is not None and not wait_for_database(docker_container, timeout):
+        return False
+    return wait_for_http(url, max(0, timeout - (time.monotonic() - start)))
+
+
+CONTAINER_GRACE_PERIOD = 10
+
+
+def prod_rebuild(force=False):
+    """
+    Rebuilds the website and the Docker images whose build context changed, or all of them with their base images pulled again if `force` is set, and restarts the production server. Returns `False` if building the images failed.
+    """
+    from build_website import build_website_cli
+    from image_fingerprints import build_changed_images
+
+    build_website_cli()
+    if build_changed_images(r("website_build"), force=force) is None:
+        print("Building the images failed, the running website was left untouched")
+        return False
     if prod_is_running():
         prod_stop()
     prod_start()
+    return True
+
+
+def docker_compose(*args, **kwargs):
+    return subprocess.run(
+        ["docker-compose", "-f", "docker-compose.prod.yaml", *args],
+        cwd=r("website_build"),
+        **kwargs,
+    )
+
+
+def service_containers(service):
+    result = docker_compose("ps", "-q", service, stdout=subprocess.PIPE, text=True)
+    return set(result.stdout.split())
+
+
+def container_state(container):
+    """
+    Returns the status of `container`, like "running" or "exited", and the status of its Docker health check, or an empty string if its image defines none.
+    """
+    result = subprocess.run(
+        ["docker", "inspect", "-f", "{{.State.Status}} {{if .State.Health}}{{.State.Health.Status}}{{end}}", container],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    if result.returncode != 0:
+        return "missing", ""
+    status, _, health = result.stdout.strip().partition(" ")
+    return status, health
+
+
+def container_is_healthy(container, started):
+    """
+    Uses the Docker health check of `container` if its image defines one. Otherwise the container counts as healthy once it has kept running for `CONTAINER_GRACE_PERIOD` seconds after `started`.
+    """
+    status, health = container_state(container)
+    if status != "running":
+        return False
+    if health:
+        return health == "healthy"
+    return time.monotonic() - started >= CONTAINER_GRACE_PERIOD
+
+
+def container_has_failed(container):
+    status, health = container_state(container)
+    return status in ["missing", "exited", "dead"] or health == "unhealthy"
 
 
-def prod_store_backup(backup_file, docker_container):
-    subprocess.run(f"docker exec -t {docker_container} pg_dumpall -c -U taktlaus > {backup_file}", shell=True)
+def remove_containers(containers):
+    if containers:
+        subprocess.run(["docker", "stop", *containers], stdout=subprocess.DEVNULL)
+        subprocess.run(["docker", "rm", *containers], stdout=subprocess.DEVNULL)
 
 
-def prod_restore_backup(backup_file, docker_container):
+def reload_proxy(proxy_service):
+    return docker_compose("exec", "-T", proxy_service, "nginx", "-s", "reload").returncode == 0
+
+
+def prod_rolling_rebuild(service="django", proxy_service="nginx", timeout=300, force=False):
+    """
+    Rebuilds the website while the old containers keep serving requests.
+
+    A container with the new image of `service` is started next to the old one and health checked. Once it is healthy, `proxy_service` is reloaded so that it resolves both the old and the new containers, then the old containers are removed and `proxy_service` is reloaded again to only send requests to the new one. If the health check fails, the new container is removed and the old ones keep running.
+    """
+    timeout = float(timeout)
+    if not prod_is_running():
+        return prod_rebuild(force) and wait_for_http()
+    from build_website import build_website_cli
+    from image_fingerprints import build_changed_images
+
+    build_website_cli()
+    built = build_changed_images(r("website_build"), force=force)
+    if built is None:
+        print("Building the images failed, the running website was left untouched")
+        return False
+    if service not in built:
+        print(f"The {service} image did not change, so the running containers were kept")
+        return True
+    old_containers = service_containers(service)
+    result = docker_compose("up", "-d", "--no-deps", "--no-recreate", "--scale", f"{service}={len(old_containers) + 1}", service)
+    if result.returncode != 0:
+        print(f"Starting a new {service} container failed, the running website was left untouched")
+        remove_containers(service_containers(service) - old_containers)
+        return False
+    new_containers = service_containers(service) - old_containers
+    if not new_containers:
+        print(f"No new {service} container was started, the running website was left untouched")
+        return False
+    started = time.monotonic()
+    healthy = wait_until(
+        lambda: all(container_is_healthy(container, started) for container in new_containers),
+        f"New {service} container",
+        timeout,
+        give_up=lambda: any(container_has_failed(container) for container in new_containers),
+    )
+    if not healthy:
+        print(f"Rolling back, the old {service} container keeps serving the website")
+        remove_containers(new_containers)
+        return False
+    if not reload_proxy(proxy_service):
+        print(f"Reloading {proxy_service} failed, rolling back")
+        remove_containers(new_containers)
+        return False
+    remove_containers(old_containers)
+    if not reload_proxy(proxy_service):
+        print(f"Reloading {proxy_service} after removing the old {service} containers failed")
+        return False
+    print(f"Switched {proxy_service} over to the new {service} container")
+    return wait_for_http()
+
+
+LOW_PRIORITY_COMMAND = 'if command -v ionice >/dev/null; then exec nice -n 19 ionice -c 3 "$@"; else exec nice -n 19 "$@"; fi'
+
+
+def low_priority(command):
+    """
+    Wraps `command`, meant to run inside a container, so that it runs with the lowest CPU priority and idle I/O priority where `ionice` is available.
+    """
+    return ["sh", "-c", LOW_PRIORITY_COMMAND, "sh", *command]
+
+
+def lower_own_priority():
+    os.nice(19)
+    if shutil.which("ionice") is not None:
+        subprocess.run(["ionice", "-c", "3", "-p", str(os.getpid())])
+
+
+def prod_store_backup(backup_file, docker_container, compression=None, backup_format="plain", jobs=None, niced=False):
+    """
+    Stores a backup of the database in `docker_container` in `backup_file`.
+
+    The "plain" `backup_format` streams `pg_dumpall` into `backup_file`, compressed with `compression` ("zstd", "gzip" or "none"). By default the compression is taken from the file extension, or zstd if available and gzip otherwise.
+
+    The "custom" and "directory" formats are Postgres' own compressed formats, which `restore-backup` can restore in parallel. The directory format is also dumped with `jobs` parallel jobs.
+
+    With `niced`, plain format dumps run with low CPU and I/O priority inside the container.
+    """
+    if backup_format == "custom":
+        return store_custom_format_backup(backup_file, docker_container)
+    if backup_format == "directory":
+        return store_directory_format_backup(backup_file, docker_container, jobs)
+    compression = compression or backup_utils.compression_from_path(backup_file) or backup_utils.default_compression()
+    try:
+        backup_utils.check_compression(compression)
+    except RuntimeError as exception:
+        print(f"Backup failed, {exception}")
+        return None
+    backup_file = backup_utils.backup_path_with_extension(backup_file, compression)
+    command = ["pg_dumpall", "-c", "-U", "taktlaus"]
+    process = subprocess.Popen(
+        ["docker", "exec", docker_container, *(low_priority(command) if niced else command)],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        backup_utils.stream_to_file(process.stdout, backup_file, compression)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        backup_utils.remove_backup_file(backup_file)
+        print(f"Backup failed, pg_dumpall exited with code {returncode}")
+        return None
+    print(f"Backup was stored in {backup_file}")
+    return backup_file
+
+
+def store_custom_format_backup(backup_file, docker_container):
+    process = subprocess.Popen(
+        ["docker", "exec", docker_container, "pg_dump", "-Fc", "-U", "taktlaus", "taktlaus_db"],
+        stdout=subprocess.PIPE,
+    )
+    try:
+        backup_utils.stream_to_file(process.stdout, backup_file, "none")
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode != 0:
+        backup_utils.remove_backup_file(backup_file)
+        print(f"Backup failed, pg_dump exited with code {returncode}")
+        return None
+    print(f"Backup was stored in {backup_file}")
+    return backup_file
+
+
+def store_directory_format_backup(backup_file, docker_container, jobs=None):
+    """
+    Dumps the database into a directory inside `docker_container` with parallel jobs, since a directory format dump can not be streamed, and copies it out to `backup_file`.
+    """
+    if os.path.exists(backup_file):
+        print(f"Backup failed, {backup_file} already exists")
+        return None
+    jobs = int(jobs or os.cpu_count() or 1)
+    container_dir = "/tmp/mytaktlausvev_backup"
+    subprocess.run(["docker", "exec", docker_container, "rm", "-rf", container_dir])
+    try:
+        result = subprocess.run(["docker", "exec", docker_container, "pg_dump", "-Fd", "-j", str(jobs), "-U", "taktlaus", "-f", container_dir, "taktlaus_db"])
+        if result.returncode != 0:
+            print(f"Backup failed, pg_dump exited with code {result.returncode}")
+            return None
+        result = subprocess.run(["docker", "cp", f"{docker_container}:{container_dir}", backup_file])
+        if result.returncode != 0:
+            if os.path.exists(backup_file):
+                shutil.rmtree(backup_file)
+            print(f"Backup failed, docker cp exited with code {result.returncode}")
+            return None
+    finally:
+        subprocess.run(["docker", "exec", docker_container, "rm", "-rf", container_dir])
+    backup_utils.write_directory_checksums(backup_file)
+    print(f"Backup was stored in {backup_file}")
+    return backup_file
+
+
+def restore_plain_format_backup(backup_file, docker_container):
+    """
+    Streams a plain format backup into `psql` in `docker_container`. Returns whether it succeeded.
+    """
+    process = subprocess.Popen(
+        ["docker", "exec", "-i", docker_container, "psql", "-U", "taktlaus", "-d", "taktlaus_db"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        backup_utils.stream_from_file(backup_file, process.stdin)
+    except BrokenPipeError:
+        pass
+    finally:
+        try:
+            process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = process.wait()
+    if returncode != 0:
+        print(f"Restore failed, psql exited with code {returncode}")
+        return False
+    return True
+
+
+def restore_parallel(backup_file, docker_container, jobs=None):
+    """
+    Copies a custom or directory format dump into `docker_container` and restores it with `pg_restore` in `jobs` parallel jobs, by default one per CPU core. Returns whether it succeeded.
+    """
+    jobs = int(jobs or os.cpu_count() or 1)
+    container_path = "/tmp/mytaktlausvev_restore"
+    subprocess.run(["docker", "exec", docker_container, "rm", "-rf", container_path])
+    try:
+        result = subprocess.run(["docker", "cp", backup_file, f"{docker_container}:{container_path}"])
+        if result.returncode != 0:
+            print(f"Restore failed, docker cp exited with code {result.returncode}")
+            return False
+        print(f"Restoring with {jobs} parallel jobs...")
+        result = subprocess.run([
+            "docker", "exec", docker_container,
+            "pg_restore", "-j", str(jobs), "--clean", "--if-exists", "-U", "taktlaus", "-d", "taktlaus_db", container_path,
+        ])
+        if result.returncode != 0:
+            print(f"Restore failed, pg_restore exited with code {result.returncode}")
+            return False
+        return True
+    finally:
+        subprocess.run(["docker", "exec", docker_container, "rm", "-rf", container_path])
+
+
+def prod_restore_backup(backup_file, docker_container, jobs=None):
+    """
+    Restores a backup made by `prod_store_backup()`, detecting its format. Custom and directory format backups are restored with `jobs` parallel jobs, by default one per CPU core.
+
+    Returns `False` if the restore failed, in which case the production server is left stopped, since its database may be empty.
+    """
+    from prompt_utils import create_prompt_session
+
+    backup_format = backup_utils.detect_backup_format(backup_file)
+    print(f"{backup_file} is a {backup_format} format backup")
     print("Resoring a backup means wiping all current database data.")
     print("Are you sure you want to proceed?")
     if not create_prompt_session().prompt_yes_no():
         return
+    checksum_ok = backup_utils.verify_checksum(backup_file)
+    if checksum_ok is False:
+        print(f"{backup_file} does not match its checksum in {backup_utils.checksum_path(backup_file)}, so it was not restored")
+        return False
+    if checksum_ok is None:
+        print(f"{backup_file} has no checksum file, so it could not be verified")
     prod_stop()
     run_in_dir(
         r("website_build"),
@@ -92,41 +557,173 @@ def prod_restore_backup(backup_file, docker_container):
         r("website_build"),
         lambda: subprocess.run("docker-compose -f docker-compose.prod.yaml up -d db", shell=True),
     )
-    print("Waiting 30 seconds for the database to start up properly...")
-    time.sleep(30)
-    subprocess.run(f"cat {backup_file} | docker exec -i {docker_container} psql -U taktlaus -d taktlaus_db", shell=True)
+    print("Waiting for the database to start up properly...")
+    if not wait_for_database(docker_container):
+        print("The backup was not restored, since the database did not start. Check the output of")
+        print(f"docker logs {docker_container}")
+        return False
+    if backup_format == "plain":
+        restored = restore_plain_format_backup(backup_file, docker_container)
+    else:
+        restored = restore_parallel(backup_file, docker_container, jobs)
+    if not restored:
+        print("The database may be empty or only partly restored, so the production server was not started again.")
+        print("The database container is still running. Fix the problem and restore again, or start the server with ./prod.py start")
+        return False
     run_in_dir(
         r("website_build"),
         lambda: subprocess.run("docker-compose -f docker-compose.prod.yaml down --remove-orphans", shell=True),
     )
     prod_start()
+    return wait_for_http()
 
 
-def prod(operation, *args):
+def prod_store_media_backup(store_dir, media_dir=os.path.expanduser("~/media_files")):
+    """
+    Stores a deduplicated snapshot of `media_dir` in the chunk store `store_dir`. Only files whose size or mtime changed since the previous snapshot are read.
+    """
+    return backup_utils.ChunkStore(store_dir).store_snapshot(media_dir)
+
+
+def prod_restore_media_backup(store_dir, media_dir=os.path.expanduser("~/media_files"), snapshot=None):
+    """
+    Restores `snapshot` from the chunk store `store_dir` into `media_dir`, by default the latest snapshot.
+    """
+    store = backup_utils.ChunkStore(store_dir)
+    snapshots = store.snapshots()
+    if not snapshots:
+        print(f"There are no media backups in {store_dir}")
+        return
+    snapshot = snapshot or snapshots[-1]
+    if snapshot not in snapshots:
+        print(f"Snapshot {snapshot} was not found, the available snapshots are:")
+        print("\n".join(snapshots))
+        return
+    store.restore_snapshot(snapshot, media_dir)
+
+
+def apply_retention(names, retention, delete):
+    keep = backup_utils.backups_to_keep(names, retention)
+    for name in sorted(set(names) - keep):
+        print(f"Deleting old backup {name}")
+        delete(name)
+
+
+def store_scheduled_backups(backup_dir, docker_container, media_dir, retention):
+    """
+    Stores a database backup in `backup_dir/database` and a media backup in the chunk store `backup_dir/media`, and deletes the backups that fall outside `retention`.
+    """
+    timestamp = time.strftime(backup_utils.TIMESTAMP_FORMAT)
+    database_dir = os.path.join(backup_dir, "database")
+    os.makedirs(database_dir, exist_ok=True)
+    prod_store_backup(os.path.join(database_dir, f"{timestamp}.sql"), docker_container, niced=True)
+
+    def delete_database_backup(name):
+        path = os.path.join(database_dir, name)
+        os.remove(path)
+        if os.path.exists(backup_utils.checksum_path(path)):
+            os.remove(backup_utils.checksum_path(path))
+
+    apply_retention(
+        [name for name in os.listdir(database_dir) if not name.endswith(".sha256") and not name.startswith(".")],
+        retention,
+        delete_database_backup,
+    )
+    if os.path.isdir(media_dir):
+        store = backup_utils.ChunkStore(os.path.join(backup_dir, "media"))
+        store.store_snapshot(media_dir)
+        apply_retention(store.snapshots(), retention, store.delete_snapshot)
+        print(f"Freed {store.collect_garbage() / 1e6:.1f} MB of unused media chunks")
+
+
+def parse_retention(retention):
+    counts = [int(count) for count in str(retention).split(",")]
+    if len(counts) != len(backup_utils.RETENTION_TIERS):
+        raise ValueError(f"retention must be {len(backup_utils.RETENTION_TIERS)} comma-separated counts, like 24,7,8")
+    return dict(zip(backup_utils.RETENTION_TIERS, counts))
+
+
+def prod_backup_daemon(backup_dir, docker_container, media_dir=os.path.expanduser("~/media_files"), interval=60, max_load=None, retention="24,7,8"):
+    """
+    Stores database and media backups in `backup_dir` every `interval` minutes until interrupted with Ctrl+C, at the lowest CPU and I/O priority.
+
+    A failing backup is logged and does not stop the daemon. `retention` is the number of hourly, daily and weekly backups to keep. A backup is postponed while the 1-minute load average is above `max_load`, by default the number of CPU cores, but never by more than one `interval`.
+    """
+    retention = parse_retention(retention)
+    interval = float(interval) * 60
+    max_load = float(max_load or os.cpu_count() or 1)
+    lower_own_priority()
+    print(f"Storing backups in {backup_dir} every {interval / 60:g} minutes, keeping {retention}")
+    try:
+        while True:
+            due = time.monotonic()
+            while os.getloadavg()[0] > max_load and time.monotonic() - due < interval:
+                print(f"Load average {os.getloadavg()[0]:.2f} is above {max_load:g}, postponing backup")
+                time.sleep(min(300, interval / 4))
+            try:
+                store_scheduled_backups(backup_dir, docker_container, media_dir, retention)
+            except Exception:
+                traceback.print_exc()
+                print(f"Storing the scheduled backups failed, trying again in {interval / 60:g} minutes")
+            time.sleep(max(0, due + interval - time.monotonic()))
+    except KeyboardInterrupt:
+        pass
+
+
+@plac.pos("operation")
+@plac.opt("compression", abbrev="c", choices=list(backup_utils.COMPRESSION_EXTENSIONS))
+@plac.opt("backup_format", abbrev="f", choices=backup_utils.BACKUP_FORMATS)
+@plac.opt("jobs", abbrev="j", type=int)
+@plac.opt("interval", abbrev="i", type=float)
+@plac.opt("max_load", abbrev="l", type=float)
+@plac.opt("retention", abbrev="k")
+@plac.opt("lines", abbrev="n", type=int)
+@plac.flg("follow", abbrev="F")
+@plac.opt("service", abbrev="s")
+@plac.opt("pattern", abbrev="p")
+@plac.flg("force", abbrev="B")
+def prod(operation, compression=None, backup_format="plain", jobs=None, interval=60, max_load=None, retention="24,7,8", lines=50, follow=False, service=None, pattern=None, force=False, *args):
     """
     This is a script that can be used to manage a running production server.
     """
     # os.chdir(os.path.dirname(os.path.abspath(__file__)))
-    log_file_path = r("prod_log.txt")
     if operation == "status":
-        if prod_is_running():
-            print("Production server is running")
+        process_id = prod_get_process_id()
+        if process_id is not None:
+            print(f"Production server is running with process id {process_id}")
         else:
             print("Production server is not running")
     elif operation == "start":
         prod_start()
+        wait_for_http()
     elif operation == "stop":
         prod_stop()
     elif operation == "rebuild":
-        prod_rebuild()
+        if prod_rebuild(force):
+            wait_for_http()
+    elif operation == "rolling-rebuild":
+        prod_rolling_rebuild(*args, force=force)
+    elif operation == "wait-ready":
+        prod_wait_ready(*args)
     # if operation == "attach":
     #     subprocess.run("screen -R mytaktlausvev_prod", shell=True)
+    elif operation == "supervise":
+        sys.exit(prod_supervise())
     elif operation == "print-log":
-        subprocess.run(f"cat {log_file_path}", shell=True)
+        subprocess.run(["cat", r("prod_log.txt")])
+    elif operation == "log":
+        prod_log(lines, follow, service, pattern)
     elif operation == "store-backup":
-        prod_store_backup(*args)
+        prod_store_backup(*args, compression=compression, backup_format=backup_format, jobs=jobs)
     elif operation == "restore-backup":
-        prod_restore_backup(*args)
+        if prod_restore_backup(*args, jobs=jobs) is False:
+            sys.exit(1)
+    elif operation == "store-media-backup":
+        prod_store_media_backup(*args)
+    elif operation == "restore-media-backup":
+        prod_restore_media_backup(*args)
+    elif operation == "backup-daemon":
+        prod_backup_daemon(*args, interval=interval, max_load=max_load, retention=retention)
     else:
         print("Operation was not recognized")
 
@@ -1,5 +1,8 @@
+import functools
+import heapq
 import os
 import re
+import time
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.key_binding import KeyBindings
@@ -12,6 +15,8 @@ from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 
 import validators
 
+from config_schema import is_valid_color_code
+
 
 key_bindings = KeyBindings()
 @key_bindings.add("end")
@@ -57,31 +62,145 @@ def choice_validator(choices):
     )
 
 
+class DirectoryIndex:
+    """
+    Caches directory listings, and only lists a directory again when its mtime changed, which happens whenever an entry is added, removed or renamed in it.
+
+    Files are stored per directory, so checking a whole tree for changes costs one `stat` per directory instead of listing every file. Checks are skipped entirely if the last one was less than `max_age` seconds ago, so typing quickly does not touch the file system at all.
+    """
+    def __init__(self, max_age=1.0):
+        self.max_age = max_age
+        self.listings = {}
+        self.files = {}
+        self.checked = {}
+        self.symlinked_dirnames = {}
+
+    def listing(self, directory):
+        """
+        Returns `(dirnames, filenames)` of `directory`, or two empty lists if it does not exist. Like `os.walk()`, symlinks to directories count as directories, and are recorded in `symlinked_dirnames` so that `walk()` does not follow them.
+        """
+        now = time.monotonic()
+        cached = self.listings.get(directory)
+        if cached is not None and now - self.checked.get(directory, 0) < self.max_age:
+            return cached[1]
+        self.checked[directory] = now
+        try:
+            mtime_ns = os.stat(directory).st_mtime_ns
+        except OSError:
+            self.listings.pop(directory, None)
+            return [], []
+        if cached is not None and cached[0] == mtime_ns:
+            return cached[1]
+        dirnames = []
+        filenames = []
+        symlinked_dirnames = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirnames.append(entry.name)
+                    if entry.is_symlink():
+                        symlinked_dirnames.add(entry.name)
+                else:
+                    filenames.append(entry.name)
+        self.symlinked_dirnames[directory] = symlinked_dirnames
+        self.listings[directory] = (mtime_ns, (sorted(dirnames), sorted(filenames)))
+        return self.listings[directory][1]
+
+    def walk(self, root_dir):
+        """
+        Returns the paths of all files under `root_dir`, relative to it, without following symlinks to directories, so that a symlink loop can not make it run forever.
+        """
+        now = time.monotonic()
+        if root_dir in self.files and now - self.checked.get(("walk", root_dir), 0) < self.max_age:
+            return self.files[root_dir]
+        self.checked[("walk", root_dir)] = now
+        files = []
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            directory = os.path.join(root_dir, relative_dir)
+            dirnames, filenames = self.listing(directory)
+            symlinked_dirnames = self.symlinked_dirnames.get(directory, set())
+            files.extend(os.path.join(relative_dir, filename) for filename in filenames)
+            pending.extend(
+                os.path.join(relative_dir, dirname)
+                for dirname in reversed(dirnames)
+                if dirname not in symlinked_dirnames
+            )
+        self.files[root_dir] = files
+        return files
+
+
+@functools.lru_cache(maxsize=64)
+def fuzzy_pattern(query):
+    return re.compile(".*?".join(re.escape(character) for character in query))
+
+
+def fuzzy_score(query, candidate):
+    """
+    Scores how well `candidate` matches `query`, where higher is better and `None` means no match. Both should be lower case.
+
+    Substring matches beat fuzzy matches, where the characters of `query` only appear in order, and fuzzy matches lose points for every character between them. Matches at the start of the file name score highest, and shorter candidates win ties.
+    """
+    position = candidate.find(query)
+    if position >= 0:
+        basename_start = candidate.rfind(os.sep) + 1
+        return 2000 + (1000 if position == basename_start else 0) - position - len(candidate)
+    match = fuzzy_pattern(query).search(candidate)
+    if match is None:
+        return None
+    return 1000 - 10 * (match.end() - match.start() - len(query)) - len(candidate)
+
+
+def rank_matches(query, candidates, max_results, lowered=None):
+    """
+    Returns the `max_results` candidates that match `query` best, best first. `lowered` can be given as `[(candidate.lower(), candidate)]` to save lowering the candidates again.
+
+    Substring matches always rank above fuzzy matches, so the fuzzy matching is skipped when there are at least `max_results` substring matches.
+    """
+    query = query.lower()
+    if lowered is None:
+        lowered = [(candidate.lower(), candidate) for candidate in candidates]
+    matches = [(lower, candidate) for lower, candidate in lowered if query in lower]
+    if len(matches) < max_results:
+        pattern = fuzzy_pattern(query)
+        matches += [(lower, candidate) for lower, candidate in lowered if query not in lower and pattern.search(lower)]
+    scored = ((fuzzy_score(query, lower), candidate) for lower, candidate in matches)
+    return [candidate for _, candidate in heapq.nlargest(max_results, scored, key=lambda item: item[0])]
+
+
 class FilePathCompleter(Completer):
-    def __init__(self, start_dir="./", recursive=False):
+    """
+    Completes paths to files in `start_dir` with ranked fuzzy matching, yielding at most `max_results` completions.
+
+    With `recursive` it matches every file in the tree, otherwise only the entries of the directory typed so far. Listings come from a `DirectoryIndex`, so the tree is only walked again when a directory in it changed.
+    """
+    def __init__(self, start_dir="./", recursive=False, max_results=50):
         self.start_dir = start_dir
         self.recursive = recursive
+        self.max_results = max_results
+        self.index = DirectoryIndex()
+        self.files = None
+        self.lowered = None
 
     def get_completions(self, document, complete_event):
-        word_before_cursor = document.text_before_cursor.lower()
+        word_before_cursor = document.text_before_cursor
         if self.recursive:
-            for dirpath, dirnames, filenames in os.walk(self.start_dir):
-                for filename in filenames:
-                    filepath = os.path.join(dirpath[len(self.start_dir)+1:], filename)
-                    if word_before_cursor in filepath:
-                        yield Completion(
-                            text=filepath,
-                            start_position=-len(word_before_cursor),
-                        )
+            files = self.index.walk(self.start_dir)
+            if files is not self.files:
+                self.files = files
+                self.lowered = [(path.lower(), path) for path in files]
+            paths = rank_matches(word_before_cursor, files, self.max_results, self.lowered)
         else:
-            dir_path = f"{os.path.join(self.start_dir, os.path.dirname(word_before_cursor))}"
-            for entry in os.listdir(dir_path or self.start_dir):
-                path = os.path.join(dir_path, entry)
-                if word_before_cursor in path:
-                    yield Completion(
-                        text=path,
-                        start_position=-len(word_before_cursor),
-                    )
+            dir_path = os.path.join(self.start_dir, os.path.dirname(word_before_cursor))
+            dirnames, filenames = self.index.listing(dir_path or self.start_dir)
+            entries = rank_matches(os.path.basename(word_before_cursor), dirnames + filenames, self.max_results)
+            paths = [os.path.join(dir_path, entry) for entry in entries]
+        for path in paths:
+            yield Completion(
+                text=path,
+                start_position=-len(word_before_cursor),
+            )
 
 
 class FilePathIsFileValidator(Validator):
@@ -94,17 +213,6 @@ class FilePathIsFileValidator(Validator):
             raise ValidationError(message=f"Dette må vere den relative filstien til ein fil i mappa {self.start_dir}.")
 
 
-def is_valid_color_code(text):
-    return (
-        len(text) == 7
-        and text[0] == "#"
-        and all(
-            character in [str(decimal) for decimal in [*range(10), "a", "b", "c", "d", "e", "f"]]
-            for character in text[1:]
-        )
-    )
-
-
 class ColorCodeValidator(Validator):
     def validate(self, document):
         text = document.text.lower()
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+
+import concurrent.futures
+import concurrent.futures.process
+import contextlib
+import os
+import subprocess
+import sys
+import time
+import traceback
+import plac
+import re
+import tomlkit
+
+from build_website import build_website
+from variable_index import CACHE_DIR
+
+
+SITE_NAME_PATTERN = re.compile(r"[a-z0-9][a-z0-9_-]*")
+
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+def set_up_production(website_build_dir, reset_database=False, project_name=None, force_build=False):
+    """
+    Builds the Docker images of a built website, all of them if `force_build` is set and otherwise the ones whose build context changed, runs the database migrations, and creates the initial data if `reset_database` is set, which deletes all existing data first. `project_name` sets the docker-compose project, so that several sites on one host get their own containers and volumes.
+    """
+    from image_fingerprints import build_changed_images
+
+    environment = dict(os.environ)
+    if project_name is not None:
+        environment["COMPOSE_PROJECT_NAME"] = project_name
+
+    def docker_compose(*args):
+        subprocess.run(
+            ["docker-compose", "-f", "docker-compose.prod.yaml", *args],
+            cwd=website_build_dir,
+            env=environment,
+            check=True,
+        )
+
+    docker_compose("down", *(["-v"] if reset_database else []), "--remove-orphans")
+    if build_changed_images(website_build_dir, environment=environment, force=force_build) is None:
+        raise RuntimeError("Building the Docker images failed")
+    docker_compose("run", "--rm", "django", "python", "site/manage.py", "migrate")
+    if reset_database:
+        docker_compose("run", "--rm", "django", "site/manage.py", "mytaktlausvev_create_initial_data")
+    docker_compose("down")
+
+
+def set_up_development(website_build_dir, dev_data, project_name=None):
+    """
+    Resets the database of a local development site, with development data if `dev_data` is set and otherwise with only the initial data, like the wizard does. `project_name` sets the docker-compose project, so that several sites on one host get their own containers and volumes.
+    """
+    environment = dict(os.environ)
+    if project_name is not None:
+        environment["COMPOSE_PROJECT_NAME"] = project_name
+    script = "reset.sh" if dev_data else "reset_with_initial_data.sh"
+    if subprocess.run([os.path.join(website_build_dir, "scripts", script)], cwd=website_build_dir, env=environment).returncode != 0:
+        raise RuntimeError(f"{script} failed")
+
+
+@contextlib.contextmanager
+def redirect_output(log_file_path):
+    """
+    Points the stdout and stderr file descriptors of this process to `log_file_path`, so that the output of subprocesses ends up there too.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = [os.dup(1), os.dup(2)]
+    with open(log_file_path, "w") as log_file:
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            for fd in saved:
+                os.close(fd)
+
+
+def load_sites(manifest_file):
+    """
+    Reads the sites from a provisioning manifest. Paths in it are relative to the manifest itself, and every site inherits the keys of the `[defaults]` table that it does not set.
+    """
+    with open(manifest_file, "r") as file:
+        manifest = tomlkit.load(file).unwrap()
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_file))
+    defaults = {
+        "base_config_file": r("taktlausconfig.toml"),
+        "output_dir": "sites",
+        "production": False,
+        "reset_database": False,
+        "link_mode": "auto",
+        **manifest.get("defaults", {}),
+    }
+    sites = []
+    for site in manifest.get("site", []):
+        site = {**defaults, **site}
+        if "name" not in site:
+            raise ValueError(f"Every [[site]] in {manifest_file} needs a name")
+        if not isinstance(site["name"], str) or SITE_NAME_PATTERN.fullmatch(site["name"]) is None:
+            raise ValueError(f"The site name {site['name']!r} in {manifest_file} can only contain lowercase letters, digits, _ and -, since it is part of the docker-compose project name")
+        if not isinstance(site.get("dev_data", False), bool):
+            raise ValueError(f"dev_data for the site {site['name']!r} in {manifest_file} must be true or false")
+        for key in ["base_config_file", "config_file", "server_secrets_file", "output_dir"]:
+            if key in site:
+                site[key] = os.path.join(manifest_dir, site[key])
+        site.setdefault("website_build_dir", os.path.join(site["output_dir"], site["name"], "website_build"))
+        site["website_build_dir"] = os.path.join(manifest_dir, site["website_build_dir"])
+        sites.append(site)
+    names = [site["name"] for site in sites]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Site names must be unique, but these appear more than once: {', '.join(duplicates)}")
+    return sites
+
+
+def site_log_file(site):
+    return os.path.join(os.path.dirname(os.path.abspath(site["website_build_dir"])), "provision_log.txt")
+
+
+def provision_site(site, cache_dir=CACHE_DIR):
+    """
+    Builds one site from the manifest, and sets up its database if it is a production site or a development site with `dev_data` set. Runs in a worker process with all output going to `provision_log.txt` next to the site's `website_build`.
+
+    Returns `{"name", "steps": {step: seconds}, "error", "log_file"}` instead of raising, so that one failing site does not stop the others.
+    """
+    result = {"name": site["name"], "steps": {}, "error": None, "log_file": site_log_file(site)}
+    os.makedirs(os.path.dirname(result["log_file"]), exist_ok=True)
+    with redirect_output(result["log_file"]):
+        try:
+            config_files = [site["base_config_file"]] + [
+                site[key] for key in ["config_file", "server_secrets_file"] if key in site
+            ]
+            start = time.perf_counter()
+            build_website(config_files, website_build_dir=site["website_build_dir"], cache_dir=cache_dir, link_mode=site["link_mode"])
+            result["steps"]["build"] = time.perf_counter() - start
+            if site["production"]:
+                start = time.perf_counter()
+                set_up_production(site["website_build_dir"], site["reset_database"], f"mytaktlausvev_{site['name']}")
+                result["steps"]["production"] = time.perf_counter() - start
+            elif "dev_data" in site:
+                start = time.perf_counter()
+                set_up_development(site["website_build_dir"], site["dev_data"], f"mytaktlausvev_{site['name']}")
+                result["steps"]["development"] = time.perf_counter() - start
+        except Exception as exception:
+            traceback.print_exc()
+            result["error"] = f"{type(exception).__name__}: {exception}"
+    return result
+
+
+def print_summary(results, seconds):
+    failed = [result for result in results if result["error"] is not None]
+    print(f"Provisioned {len(results) - len(failed)} of {len(results)} sites in {seconds:.1f} seconds")
+    for result in results:
+        steps = ", ".join(f"{step} {step_seconds:.1f} s" for step, step_seconds in result["steps"].items())
+        status = "ok" if result["error"] is None else "FAILED"
+        print(f"  {result['name']:<24} {status:<7} {steps}")
+        if result["error"] is not None:
+            print(f"    {result['error']}, see {result['log_file']}")
+
+
+@plac.pos("manifest_file")
+@plac.opt("jobs", abbrev="j", type=int)
+@plac.opt("only", abbrev="o")
+def provision(manifest_file, jobs=None, only=None):
+    """
+    Builds every site in `manifest_file` into its own website_build, without asking anything, in `jobs` parallel processes (by default one per CPU core).
+
+    The manifest is a TOML file with a [[site]] table per site. A site needs a `name`, and takes a `config_file`, a `server_secrets_file`, a `base_config_file` (taktlausconfig.toml by default) and a `website_build_dir` (`output_dir/name/website_build` by default). Production sites (`production = true`) also get their Docker images built and their database migrated. With `reset_database = true`, all existing data is deleted and the initial data is created again. Development sites get their database reset if they set `dev_data`, with development data if it is true and with only the initial data if it is false. Files without config variables are shared between the sites as reflinks or hardlinks where the file system allows it, which `link_mode = "copy"` turns off, see `./build_website.py -h`. Keys in a [defaults] table apply to every site.
+
+    Example usage:
+    ./provision.py sites.toml
+    ./provision.py -j 2 -o taktlaus,taktfull sites.toml
+    """
+    sites = load_sites(manifest_file)
+    if only is not None:
+        names = only.split(",")
+        unknown = sorted(set(names) - {site["name"] for site in sites})
+        if unknown:
+            print(f"These sites are not in {manifest_file}: {', '.join(unknown)}")
+            sys.exit(1)
+        sites = [site for site in sites if site["name"] in names]
+    jobs = max(1, min(int(jobs or os.cpu_count() or 1), len(sites) or 1))
+    print(f"Provisioning {len(sites)} sites with {jobs} parallel jobs")
+    start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(provision_site, site): site for site in sites}
+        results = []
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool as exception:
+                site = futures[future]
+                result = {
+                    "name": site["name"],
+                    "steps": {},
+                    "error": f"The worker process died: {exception}",
+                    "log_file": site_log_file(site),
+                }
+            print(f"{result['name']}: {'ok' if result['error'] is None else 'FAILED'}")
+            results.append(result)
+    results.sort(key=lambda result: [site["name"] for site in sites].index(result["name"]))
+    print_summary(results, time.perf_counter() - start)
+    if any(result["error"] is not None for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    plac.call(provision)
@@ -0,0 +1,281 @@
+#!/usr/bin/python3
+
+import contextlib
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import plac
+import tomlkit
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+sys.path.append(r("../"))
+
+from build_website import TomlDict, build_website, render_template
+from test import test_count
+from test_startup import STARTUP_BUDGETS, import_time
+
+
+def render_template_legacy(build, config):
+    """
+    The substitution loop `build_website` used before `render_template`, kept here to compare against.
+    """
+    while True:
+        match = re.search(r"\(MYTAKTLAUSVEV_VARIABLE\((.+?)\)\)", build)
+        if match is None:
+            break
+        variable = match.group(1)
+        replacement = config[variable] if variable in config else ""
+        print("Replacing", variable, "with", replacement)
+        build = build[:match.start()] + replacement + build[match.end():]
+    return build
+
+
+def generate_filler(length):
+    return ("<p>Lorem ipsum dolor sit amet</p>\n" * (length // 33 + 1))[:length]
+
+
+def generate_template(marker_count, filler_length=200, variable_count=50):
+    filler = generate_filler(filler_length)
+    return "".join(
+        f"{filler}(MYTAKTLAUSVEV_VARIABLE(benchmark.variable_{i % variable_count}))"
+        for i in range(marker_count)
+    )
+
+
+def generate_config(variable_count=50):
+    return {f"benchmark.variable_{i}": f"Value number {i}" for i in range(variable_count)}
+
+
+def variable_name(i, depth):
+    """
+    Returns a dotted config variable name `depth` levels deep, spreading the variables over several tables per level.
+    """
+    return ".".join([f"level_{level}_{i % (level + 2)}" for level in range(depth - 1)] + [f"variable_{i}"])
+
+
+def generate_deep_config(variable_count, depth):
+    config = TomlDict(tomlkit.document())
+    for i in range(variable_count):
+        config[variable_name(i, depth)] = f"Value number {i}"
+    return config
+
+
+def generate_website_source(root_dir, file_count, file_size, marker_density, variable_count, depth=3, seed=0):
+    """
+    Generates a synthetic `website_source`, `static_files` and config file in `root_dir`.
+
+    `marker_density` is the number of markers per kilobyte of template. Every fourth file is a binary file without markers, like the images in a real tree.
+
+    Returns `(website_source_dir, static_files_dir, config_file)`.
+    """
+    generator = random.Random(seed)
+    website_source_dir = os.path.join(root_dir, "website_source")
+    static_files_dir = os.path.join(root_dir, "static_files")
+    marker_count = max(0, round(file_size / 1024 * marker_density))
+    filler_length = file_size // (marker_count + 1)
+    for i in range(file_count):
+        directory = os.path.join(website_source_dir, "site", f"app_{i % 20}", "templates")
+        os.makedirs(directory, exist_ok=True)
+        if i % 4 == 3:
+            with open(os.path.join(directory, f"image_{i}.png"), "wb") as file:
+                file.write(generator.randbytes(file_size))
+            continue
+        with open(os.path.join(directory, f"template_{i}.html"), "w") as file:
+            for _ in range(marker_count):
+                file.write(generate_filler(filler_length))
+                file.write(f"(MYTAKTLAUSVEV_VARIABLE({variable_name(generator.randrange(variable_count), depth)}))")
+            file.write(generate_filler(filler_length))
+    os.makedirs(os.path.join(static_files_dir, "images"), exist_ok=True)
+    for i in range(max(1, file_count // 10)):
+        with open(os.path.join(static_files_dir, "images", f"static_{i}.svg"), "w") as file:
+            file.write(generate_filler(file_size))
+    config_file = os.path.join(root_dir, "config.toml")
+    with open(config_file, "w") as file:
+        tomlkit.dump(generate_deep_config(variable_count, depth).get_tomlkit_document(), file)
+    return website_source_dir, static_files_dir, config_file
+
+
+def measure(function, repeat, setup=None):
+    """
+    Runs `function` `repeat` times with stdout silenced and returns the minimum and median wall time in seconds. `setup` is run before every repetition without being timed.
+    """
+    times = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times)}
+
+
+def benchmark_render(results, repeat, marker_counts=(100, 1000, 5000)):
+    config = generate_config()
+    for marker_count in marker_counts:
+        template = generate_template(marker_count)
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            assert render_template_legacy(template, config) == render_template(template, config)
+        results[f"render/legacy/{marker_count}_markers"] = measure(lambda: render_template_legacy(template, config), repeat)
+        results[f"render/single_pass/{marker_count}_markers"] = measure(lambda: render_template(template, config), repeat)
+    template = generate_filler(len(generate_template(marker_counts[-1])))
+    results["render/single_pass/0_markers"] = measure(lambda: render_template(template, config), repeat)
+
+
+def benchmark_config(results, repeat, variable_count, depth):
+    config = generate_deep_config(variable_count, depth)
+    other = generate_deep_config(variable_count // 2, depth)
+    keys = [variable_name(i, depth) for i in range(variable_count)]
+    missing_keys = [f"{key}_missing" for key in keys]
+    snapshot = config.snapshot()
+    results["toml_dict/get"] = measure(lambda: [config[key] for key in keys], repeat)
+    results["toml_dict/contains"] = measure(lambda: [key in config for key in keys + missing_keys], repeat)
+    results["toml_dict/iter"] = measure(lambda: list(config), repeat)
+    results["toml_dict/update"] = measure(lambda: generate_deep_config(variable_count, depth).update(other), repeat)
+    results["toml_dict/snapshot"] = measure(config.snapshot, repeat)
+    results["config_snapshot/get"] = measure(lambda: [snapshot[key] for key in keys], repeat)
+    results["config_snapshot/contains"] = measure(lambda: [key in snapshot for key in keys + missing_keys], repeat)
+
+
+def benchmark_build(results, repeat, file_count, file_size, marker_density, variable_count, depth, jobs):
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_file = generate_website_source(
+            root_dir, file_count, file_size, marker_density, variable_count, depth,
+        )
+        changed_config_file = os.path.join(root_dir, "changed_config.toml")
+        changed_config = TomlDict(tomlkit.document())
+        changed_config[variable_name(0, depth)] = "Changed value"
+        with open(changed_config_file, "w") as file:
+            tomlkit.dump(changed_config.get_tomlkit_document(), file)
+        cache_dir = os.path.join(root_dir, "cache")
+        count_index_path = os.path.join(root_dir, "count_index.json")
+
+        def build(config_files, clean=False):
+            build_website(
+                config_files,
+                clean=clean,
+                jobs=jobs,
+                website_source_dir=website_source_dir,
+                static_files_dir=static_files_dir,
+                website_build_dir=os.path.join(root_dir, "website_build"),
+                cache_dir=cache_dir,
+            )
+
+        def clear_cache():
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        def clear_count_index():
+            if os.path.exists(count_index_path):
+                os.remove(count_index_path)
+
+        def count():
+            test_count(website_source_dir, os.path.join(root_dir, "counts.toml"), count_index_path)
+
+        results["build/clean"] = measure(lambda: build([config_file], clean=True), repeat, setup=clear_cache)
+        results["build/no_op"] = measure(lambda: build([config_file]), repeat)
+        results["build/one_variable_changed"] = measure(
+            lambda: build([config_file, changed_config_file]),
+            repeat,
+            setup=lambda: build([config_file]),
+        )
+        results["test_count/cold"] = measure(count, repeat, setup=clear_count_index)
+        results["test_count/warm"] = measure(count, repeat)
+
+
+def benchmark_startup(results, repeat):
+    for module in STARTUP_BUDGETS:
+        seconds = import_time(module, repeat)
+        results[f"startup/{module}"] = {"min": seconds, "median": seconds}
+
+
+def print_results(results, previous_results=None):
+    for name, result in results.items():
+        line = f"{name:<40} min {result['min'] * 1000:10.2f} ms   median {result['median'] * 1000:10.2f} ms"
+        if previous_results is not None and name in previous_results:
+            line += f"   {previous_results[name]['median'] / result['median']:6.2f}x vs previous"
+        print(line)
+
+
+@plac.opt("suite", abbrev="s", choices=["all", "render", "config", "build", "startup"])
+@plac.opt("repeat", abbrev="r", type=int)
+@plac.opt("file_count", abbrev="n", type=int)
+@plac.opt("file_size", abbrev="b", type=int)
+@plac.opt("marker_density", abbrev="d", type=float)
+@plac.opt("variable_count", abbrev="v", type=int)
+@plac.opt("depth", abbrev="D", type=int)
+@plac.opt("jobs", abbrev="j", type=int)
+@plac.opt("output", abbrev="o")
+@plac.opt("compare", abbrev="c")
+def benchmark(
+    suite="all",
+    repeat=3,
+    file_count=500,
+    file_size=8192,
+    marker_density=2.0,
+    variable_count=200,
+    depth=3,
+    jobs=1,
+    output=None,
+    compare=None,
+):
+    """
+    Benchmarks the template engine, the config layer and the build pipeline on synthetic input, and the import time of the entry points.
+
+    Results are reported as the minimum and median of `repeat` runs. Store them with `output` and compare a later run against them with `compare`, using the same parameters.
+
+    Example usage:
+    ./tests/benchmark.py -o before.json
+    ./tests/benchmark.py -c before.json
+    """
+    parameters = {
+        "repeat": repeat,
+        "file_count": file_count,
+        "file_size": file_size,
+        "marker_density": marker_density,
+        "variable_count": variable_count,
+        "depth": depth,
+        "jobs": jobs,
+    }
+    previous_results = None
+    if compare is not None:
+        with open(compare, "r") as file:
+            previous = json.load(file)
+        if previous["parameters"] != parameters:
+            print("Warning: the compared results were measured with different parameters")
+        previous_results = previous["results"]
+
+    results = {}
+    if suite in ["all", "render"]:
+        benchmark_render(results, repeat)
+    if suite in ["all", "config"]:
+        benchmark_config(results, repeat, variable_count, depth)
+    if suite in ["all", "build"]:
+        benchmark_build(results, repeat, file_count, file_size, marker_density, variable_count, depth, jobs)
+    if suite in ["all", "startup"]:
+        benchmark_startup(results, repeat)
+
+    print_results(results, previous_results)
+    if output is not None:
+        with open(output, "w") as file:
+            json.dump({
+                "parameters": parameters,
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, file, indent=4)
+
+
+if __name__ == "__main__":
+    plac.call(benchmark)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules under test are flat scripts in the repository root, not a package.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
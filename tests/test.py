@@ -26,32 +26,17 @@ def run_in_dir(directory, callable):
 sys.path.append(r("../"))
 
 from build_website import TomlDict
+from variable_index import VariableIndex
 
 
-def test_count():
-    website_source_dir = r("../website_source")
+def test_count(website_source_dir=r("../website_source"), counts_file=r("counts.toml"), index_path=None):
+    index = VariableIndex(website_source_dir, index_path).refresh()
+    index.save()
     counts = TomlDict({})
+    for variable, count in index.counts().items():
+        counts[variable] = count
 
-    for dirpath, dirnames, filenames in os.walk(website_source_dir):
-        for filename in filenames:
-            filepath = os.path.join(dirpath, filename)
-            _, extension = os.path.splitext(filepath)
-            if extension in [".py", ".html", ".scss", ".js", ".md", ".conf", ".env", ".json"]:
-                with open(filepath, "r") as file:
-                    content = file.read()
-                while True:
-                    match = re.search(r"\(MYTAKTLAUSVEV_VARIABLE\((.+?)\)\)", content)
-                    if match is None:
-                        break
-                    variable = match.group(1)
-                    if variable in counts:
-                        counts[variable] += 1
-                    else:
-                        counts[variable] = 1
-                    # print("Counted", variable, counts[variable], "time(s)")
-                    content = content[match.end():]
-
-    with open(r("counts.toml"), "w") as file:
+    with open(counts_file, "w") as file:
         tomlkit.dump(counts.get_tomlkit_document(), file)
     
     return counts
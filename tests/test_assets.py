@@ -0,0 +1,46 @@
+import hashlib
+import io
+import os
+import tempfile
+
+from PIL import Image, PngImagePlugin
+
+import assets
+
+
+def png(image, **kwargs):
+    output = io.BytesIO()
+    image.save(output, format="PNG", **kwargs)
+    return output.getvalue()
+
+
+def test_minify_svg_keeps_whitespace_in_text():
+    svg = b"<svg>\n  <!-- logo -->\n  <text>\n    <tspan>Dei</tspan>\n    <tspan>Taktlause</tspan>\n  </text>\n  <rect/>\n</svg>\n"
+    assert assets.minify_svg(svg) == b"<svg><text>\n    <tspan>Dei</tspan>\n    <tspan>Taktlause</tspan>\n  </text><rect/></svg>\n"
+
+
+def test_recompress_png_leaves_lossy_cases_alone():
+    frames = [Image.new("RGB", (64, 64), color) for color in ["red", "blue"]]
+    animated = png(frames[0], save_all=True, append_images=frames[1:], compress_level=0)
+    deep = png(Image.new("I;16", (64, 64), 40000), compress_level=0)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Author", "Dei Taktlause")
+    with_text = png(frames[0], compress_level=0, pnginfo=info)
+    for data in [animated, deep, with_text]:
+        assert assets.recompress_png(data) == data
+        assert assets.optimise("image.png", data) == data
+    plain = png(frames[0], compress_level=0)
+    assert len(assets.recompress_png(plain)) < len(plain)
+
+
+def test_hashed_path_follows_served_content():
+    with tempfile.TemporaryDirectory() as root_dir:
+        source_path = os.path.join(root_dir, "icon.svg")
+        with open(source_path, "wb") as file:
+            file.write(b"<svg>\n" + b"  <rect/>\n" * 50 + b"</svg>\n")
+        with open(source_path, "rb") as file:
+            source_hash = hashlib.sha256(file.read()).hexdigest()
+        output_hash = assets.output_hash(source_path, source_hash, root_dir)
+        served = assets.process_asset(source_path, source_hash, root_dir)[""]
+        assert output_hash == hashlib.sha256(served).hexdigest() != source_hash
+        assert assets.hashed_path("images/icon.svg", output_hash) == f"images/icon.{output_hash[:10]}.svg"
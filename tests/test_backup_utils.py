@@ -0,0 +1,89 @@
+import io
+import os
+import tempfile
+import time
+
+import pytest
+
+import backup_utils
+from backup_utils import TIMESTAMP_FORMAT, ChunkStore, backups_to_keep
+
+
+def backup_name(hours_ago):
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(1_700_000_000 - hours_ago * 3600)) + ".sql.gz"
+
+
+def test_backups_to_keep():
+    names = [backup_name(hours_ago) for hours_ago in range(24 * 30)] + ["manual_backup.sql"]
+    keep = backups_to_keep(names, {"hourly": 24, "daily": 7, "weekly": 4})
+    assert "manual_backup.sql" in keep
+    assert all(backup_name(hours_ago) in keep for hours_ago in range(24))
+    assert backup_name(24 * 29) not in keep
+    days = {name[:10] for name in keep if name != "manual_backup.sql"}
+    assert len(days) <= 1 + 7 + 4
+    assert backups_to_keep(names, {"hourly": 0, "daily": 0, "weekly": 0}) == {"manual_backup.sql"}
+
+
+def test_chunk_store_deduplicates_and_collects_garbage():
+    with tempfile.TemporaryDirectory() as root_dir:
+        media_dir = os.path.join(root_dir, "media")
+        os.makedirs(os.path.join(media_dir, "images"))
+        for filename in ["a.jpg", "images/b.jpg"]:
+            with open(os.path.join(media_dir, filename), "wb") as file:
+                file.write(bytes(range(256)) * 1000)
+        store = ChunkStore(os.path.join(root_dir, "store"))
+        first = store.store_snapshot(media_dir)
+        assert store.stored_bytes == 256 * 1000
+        with open(os.path.join(media_dir, "a.jpg"), "wb") as file:
+            file.write(b"changed")
+        store.store_snapshot(media_dir)
+        store.restore_snapshot(first, os.path.join(root_dir, "restored"))
+        with open(os.path.join(root_dir, "restored", "a.jpg"), "rb") as file:
+            assert file.read() == bytes(range(256)) * 1000
+        store.delete_snapshot(first)
+        assert store.collect_garbage() == 0
+
+
+def test_chunk_store_skips_files_deleted_during_the_walk(monkeypatch):
+    with tempfile.TemporaryDirectory() as root_dir:
+        media_dir = os.path.join(root_dir, "media")
+        os.makedirs(media_dir)
+        with open(os.path.join(media_dir, "a.jpg"), "wb") as file:
+            file.write(b"kept")
+        monkeypatch.setattr(backup_utils, "list_files", lambda directory: ["a.jpg", "deleted.jpg"])
+        store = ChunkStore(os.path.join(root_dir, "store"))
+        name = store.store_snapshot(media_dir)
+        assert list(store.load_snapshot(name)["files"]) == ["a.jpg"]
+
+
+def test_stream_round_trip():
+    data = b"".join(f"INSERT INTO table VALUES ({i});\n".encode() for i in range(100_000))
+    compressions = ["none", "gzip"] + (["zstd"] if backup_utils.zstandard is not None else [])
+    with tempfile.TemporaryDirectory() as root_dir:
+        for compression in compressions:
+            path = os.path.join(root_dir, f"backup.sql{backup_utils.COMPRESSION_EXTENSIONS[compression]}")
+            backup_utils.stream_to_file(io.BytesIO(data), path, compression)
+            assert backup_utils.verify_checksum(path) is True
+            restored = io.BytesIO()
+            backup_utils.stream_from_file(path, restored)
+            assert restored.getvalue() == data
+            with open(path, "r+b") as file:
+                file.seek(100)
+                file.write(b"corrupt")
+            assert backup_utils.verify_checksum(path) is False
+
+
+def test_stream_to_file_removes_partial_file():
+    class FailingSource:
+        def read(self, size):
+            raise OSError("the dump broke off")
+
+    with tempfile.TemporaryDirectory() as root_dir:
+        path = os.path.join(root_dir, "backup.sql.gz")
+        with pytest.raises(OSError):
+            backup_utils.stream_to_file(FailingSource(), path, "gzip")
+        assert os.listdir(root_dir) == []
+        if backup_utils.zstandard is None:
+            with pytest.raises(RuntimeError):
+                backup_utils.stream_to_file(io.BytesIO(b"data"), os.path.join(root_dir, "backup.sql.zst"), "zstd")
+            assert os.listdir(root_dir) == []
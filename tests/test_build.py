@@ -0,0 +1,198 @@
+import os
+import shutil
+import tempfile
+
+from build_website import build_website
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+def create_source_tree(root_dir, file_count=40):
+    website_source_dir = os.path.join(root_dir, "website_source")
+    static_files_dir = os.path.join(root_dir, "static_files")
+    for i in range(file_count):
+        directory = os.path.join(website_source_dir, "site", f"app_{i % 5}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"template_{i}.html"), "w") as file:
+            file.write(
+                f"<title>(MYTAKTLAUSVEV_VARIABLE(appearance.orchestra_name)) {i}</title>\n"
+                f"<p>æøå (MYTAKTLAUSVEV_VARIABLE(appearance.navbar.title)) (MYTAKTLAUSVEV_VARIABLE(missing.variable))</p>\n"
+                * (i + 1)
+            )
+        with open(os.path.join(directory, f"data_{i}.bin"), "wb") as file:
+            file.write(bytes(range(256)) * (i + 1))
+    os.makedirs(os.path.join(website_source_dir, "scripts"))
+    with open(os.path.join(website_source_dir, "scripts", "up.sh"), "w") as file:
+        file.write("#!/bin/sh\necho (MYTAKTLAUSVEV_VARIABLE(domain))\n")
+    os.chmod(os.path.join(website_source_dir, "scripts", "up.sh"), 0o755)
+    with open(os.path.join(website_source_dir, "nginx.conf"), "w") as file:
+        file.write("server_name (MYTAKTLAUSVEV_VARIABLE(domain));\n")
+    os.makedirs(os.path.join(static_files_dir, "images"))
+    for filename in os.listdir(r("../static_files/images")):
+        shutil.copy(r("../static_files/images", filename), os.path.join(static_files_dir, "images", filename))
+    with open(os.path.join(static_files_dir, "images", "logo.svg"), "w") as file:
+        file.write("<svg>(MYTAKTLAUSVEV_VARIABLE(domain))</svg>\n")
+    with open(os.path.join(static_files_dir, "manifest.json"), "w") as file:
+        file.write('{"name": "(MYTAKTLAUSVEV_VARIABLE(appearance.manifest.name))"}\n')
+    config_file = os.path.join(root_dir, "config.toml")
+    with open(config_file, "w") as file:
+        file.write('domain = "example.no"\n')
+    return website_source_dir, static_files_dir, [r("../taktlausconfig.toml"), config_file]
+
+
+def build(root_dir, **kwargs):
+    """
+    Builds the tree that `create_source_tree` made in `root_dir` into `root_dir/website_build`, with its cache in `root_dir/cache`. `kwargs` are passed on to `build_website` and override these defaults.
+    """
+    return build_website(
+        [r("../taktlausconfig.toml"), os.path.join(root_dir, "config.toml")],
+        **{
+            "website_source_dir": os.path.join(root_dir, "website_source"),
+            "static_files_dir": os.path.join(root_dir, "static_files"),
+            "website_build_dir": os.path.join(root_dir, "website_build"),
+            "cache_dir": os.path.join(root_dir, "cache"),
+            **kwargs,
+        },
+    )
+
+
+def read_tree(root_dir):
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, "rb") as file:
+                tree[os.path.relpath(path, root_dir)] = (file.read(), os.stat(path).st_mode)
+    return tree
+
+
+def test_parallel_build_is_identical_to_serial_build():
+    with tempfile.TemporaryDirectory() as root_dir:
+        create_source_tree(root_dir)
+        builds = {}
+        for jobs in [1, 4]:
+            website_build_dir = os.path.join(root_dir, f"website_build_{jobs}")
+            build(root_dir, jobs=jobs, website_build_dir=website_build_dir)
+            builds[jobs] = read_tree(website_build_dir)
+        assert builds[1] == builds[4]
+        assert builds[1]["nginx.conf"][0] == b"server_name example.no;\n"
+
+
+def test_hashed_static_files():
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_files = create_source_tree(root_dir, file_count=1)
+        with open(os.path.join(static_files_dir, "images", "icon.svg"), "w") as file:
+            file.write("<svg>\n  <!-- comment -->\n" + "  <rect width='1' height='1'/>\n" * 100 + "</svg>\n")
+        with open(os.path.join(website_source_dir, "icon.html"), "w") as file:
+            file.write("<img src=\"/static/(MYTAKTLAUSVEV_VARIABLE(appearance.icon))\">\n")
+        with open(config_files[-1], "a") as file:
+            file.write('[appearance]\nicon = "images/icon.svg"\n')
+        website_build_dir = os.path.join(root_dir, "website_build")
+        build(root_dir, hash_static_files=True)
+        tree = read_tree(website_build_dir)
+        hashed_path = tree["icon.html"][0].decode().split("/static/")[1].split('"')[0]
+        assert hashed_path != "images/icon.svg"
+        assert tree[f"site/static/{hashed_path}"][0] == tree["site/static/images/icon.svg"][0]
+        assert b"comment" not in tree["site/static/images/icon.svg"][0]
+        assert f"site/static/{hashed_path}.gz" in tree
+        assert "site/static/images/logo.svg.gz" not in tree
+
+
+def test_hardlinked_builds_share_marker_free_files():
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_files = create_source_tree(root_dir, file_count=2)
+        data_path = os.path.join(website_source_dir, "site", "app_0", "data_0.bin")
+        with open(data_path, "rb") as file:
+            data = file.read()
+        builds = {}
+        for link_mode in ["copy", "hardlink", "hardlink"]:
+            website_build_dir = os.path.join(root_dir, f"website_build_{link_mode}")
+            build(root_dir, jobs=2, website_build_dir=website_build_dir, link_mode=link_mode)
+            builds[link_mode] = read_tree(website_build_dir)
+        assert {
+            path: content for path, content in builds["hardlink"].items() if not path.startswith(".")
+        } == {
+            path: content for path, content in builds["copy"].items() if not path.startswith(".")
+        }
+        linked_path = os.path.join(root_dir, "website_build_hardlink", "site", "app_0", "data_0.bin")
+        assert os.path.samefile(linked_path, data_path)
+        assert not os.path.samefile(os.path.join(root_dir, "website_build_hardlink", "nginx.conf"), os.path.join(website_source_dir, "nginx.conf"))
+
+        nginx_conf_path = os.path.join(website_source_dir, "nginx.conf")
+        for content in ["listen 80;\n", "server_name (MYTAKTLAUSVEV_VARIABLE(domain));\n"]:
+            with open(nginx_conf_path, "w") as file:
+                file.write(content)
+            build(root_dir, website_build_dir=os.path.join(root_dir, "website_build_hardlink"), link_mode="hardlink")
+        with open(nginx_conf_path, "r") as file:
+            assert file.read() == "server_name (MYTAKTLAUSVEV_VARIABLE(domain));\n"
+        with open(data_path, "rb") as file:
+            assert file.read() == data
+
+
+def build_mtimes(website_build_dir):
+    """
+    Sets the mtime of every file in `website_build_dir` back to a fixed time, so that any rewrite shows up in `st_mtime_ns`, and returns a function that lists the rewritten files.
+    """
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(website_build_dir):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            os.utime(path, ns=(1_000_000_000, 1_000_000_000))
+            paths.append(path)
+
+    def rewritten():
+        return sorted(
+            os.path.relpath(path, website_build_dir)
+            for path in paths
+            if os.stat(path).st_mtime_ns != 1_000_000_000
+        )
+    return rewritten
+
+
+def test_rebuild_only_rewrites_files_using_changed_variables():
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_files = create_source_tree(root_dir, file_count=3)
+        website_build_dir = os.path.join(root_dir, "website_build")
+
+        build(root_dir)
+        rewritten = build_mtimes(website_build_dir)
+        before = read_tree(website_build_dir)
+        assert build(root_dir).files == []
+        assert rewritten() == []
+        assert read_tree(website_build_dir) == before
+
+        with open(config_files[-1], "w") as file:
+            file.write('domain = "example.com"\n')
+        build(root_dir)
+        assert rewritten() == [".mytaktlausvev_manifest.json", "nginx.conf"]
+        assert read_tree(website_build_dir)["nginx.conf"][0] == b"server_name example.com;\n"
+
+
+def test_rebuild_removes_stale_outputs():
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_files = create_source_tree(root_dir, file_count=1)
+        icon_path = os.path.join(static_files_dir, "images", "icon.svg")
+        website_build_dir = os.path.join(root_dir, "website_build")
+
+        def build_outputs():
+            build(root_dir, hash_static_files=True)
+            return set(read_tree(website_build_dir))
+
+        for version in range(2):
+            with open(icon_path, "w") as file:
+                file.write("<svg>\n" + f"  <rect width='{version}' height='1'/>\n" * 100 + "</svg>\n")
+            outputs = build_outputs()
+        icons = sorted(path for path in outputs if path.startswith("site/static/images/icon."))
+        assert len(icons) == 4
+        assert icons[-2:] == ["site/static/images/icon.svg", "site/static/images/icon.svg.gz"]
+
+        os.remove(icon_path)
+        os.remove(os.path.join(website_source_dir, "nginx.conf"))
+        outputs = build_outputs()
+        assert not any(path.startswith("site/static/images/icon.") for path in outputs)
+        assert "nginx.conf" not in outputs
+        assert "scripts/up.sh" in outputs
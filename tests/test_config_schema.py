@@ -0,0 +1,54 @@
+import os
+import re
+import tempfile
+
+import pytest
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+from build_website import load_config
+from config_schema import ConfigError, load_schema, validate_config
+from test_build import build, create_source_tree
+
+
+def test_schema_covers_documented_variables():
+    with open(r("../README.md"), "r") as file:
+        readme = file.read()
+    reference = readme[readme.index("### Full config variable reference"):]
+    documented = set(re.findall(r"^\|\s*`(.+?)`\s*\|", reference, re.MULTILINE))
+    _, schema = load_schema()
+    assert set(schema) == documented
+
+
+def test_base_config_is_valid():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        validate_config(load_config([r("../taktlausconfig.toml")]).snapshot(), {
+            "images/taktlausfavicon.ico",
+            "images/taktlauslogo.svg",
+            "images/taktlauslogo_santa_hat.svg",
+            "images/taktlaus-apple-touch-icon.png",
+        }, cache_dir=cache_dir)
+
+
+def test_invalid_config_fails_before_building():
+    with tempfile.TemporaryDirectory() as root_dir:
+        website_source_dir, static_files_dir, config_files = create_source_tree(root_dir, file_count=1)
+        with open(config_files[-1], "a") as file:
+            file.write(
+                '[appearance]\nprimary_color = "red"\nfavicon = "images/missing.ico"\n'
+                '[production]\nhosting_solution = "cloud"\n'
+            )
+        website_build_dir = os.path.join(root_dir, "website_build")
+        for _ in range(2):
+            with pytest.raises(ConfigError) as exception:
+                build(root_dir)
+            assert [error.split(" = ")[0] for error in exception.value.errors] == [
+                "appearance.primary_color",
+                "production.hosting_solution",
+                "appearance.favicon",
+            ]
+            assert not os.path.exists(website_build_dir)
@@ -0,0 +1,86 @@
+import hashlib
+import io
+import os
+import sys
+import tempfile
+
+from PIL import Image
+
+import icons
+from icons import FAVICON_SIZES, ICON_SIZES, generate_icons, icon_cache_path
+
+
+def write_logo(static_files_dir, size=(600, 400)):
+    path = os.path.join(static_files_dir, "images", "logo.png")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.new("RGBA", size, (200, 30, 30, 255)).save(path)
+    return "images/logo.png"
+
+
+def test_generate_icons(monkeypatch):
+    with tempfile.TemporaryDirectory() as root_dir:
+        static_files_dir = os.path.join(root_dir, "static_files")
+        cache_dir = os.path.join(root_dir, "cache")
+        logo_path = write_logo(static_files_dir)
+        outputs = generate_icons(logo_path, static_files_dir, cache_dir)
+        assert outputs == {
+            "favicon": "images/logo-favicon.ico",
+            "apple_touch_icon": "images/logo-apple-touch-icon.png",
+            "manifest_icon_192": "images/logo-192.png",
+            "manifest_icon_512": "images/logo-512.png",
+        }
+
+        with open(os.path.join(static_files_dir, logo_path), "rb") as file:
+            source_hash = hashlib.sha256(file.read()).hexdigest()
+        for size in ICON_SIZES:
+            with Image.open(icon_cache_path(cache_dir, source_hash, size)) as icon:
+                assert icon.size == (size, size)
+                # The 3:2 logo is centered in the square with transparent bands above and below.
+                assert icon.getpixel((size // 2, size // 2))[3] == 255
+                assert icon.getpixel((size // 2, 0))[3] == 0
+        with Image.open(os.path.join(static_files_dir, outputs["favicon"])) as favicon:
+            assert sorted(favicon.info["sizes"]) == [(size, size) for size in FAVICON_SIZES]
+        with Image.open(os.path.join(static_files_dir, outputs["apple_touch_icon"])) as icon:
+            assert icon.size == (180, 180)
+
+        mtimes = {path: os.stat(os.path.join(static_files_dir, path)).st_mtime_ns for path in outputs.values()}
+
+        def fail(*args):
+            raise AssertionError("The logo was decoded even though every size is cached")
+
+        monkeypatch.setattr(icons, "decode_source", fail)
+        assert generate_icons(logo_path, static_files_dir, cache_dir) == outputs
+        assert mtimes == {path: os.stat(os.path.join(static_files_dir, path)).st_mtime_ns for path in outputs.values()}
+
+
+def test_render_icons_decodes_once_for_missing_sizes(monkeypatch):
+    with tempfile.TemporaryDirectory() as root_dir:
+        static_files_dir = os.path.join(root_dir, "static_files")
+        cache_dir = os.path.join(root_dir, "cache")
+        logo_path = os.path.join(static_files_dir, write_logo(static_files_dir))
+        with open(logo_path, "rb") as file:
+            source_hash = hashlib.sha256(file.read()).hexdigest()
+        rendered = icons.render_icons(logo_path, cache_dir)
+        os.remove(icon_cache_path(cache_dir, source_hash, 32))
+        os.remove(icon_cache_path(cache_dir, source_hash, 512))
+
+        decoded = []
+        decode_source = icons.decode_source
+
+        def counting_decode_source(source_path, data, size):
+            decoded.append(size)
+            return decode_source(source_path, data, size)
+
+        monkeypatch.setattr(icons, "decode_source", counting_decode_source)
+        assert icons.render_icons(logo_path, cache_dir) == rendered
+        assert decoded == [512]
+
+
+def test_render_icons_warns_about_upscaling(capsys):
+    with tempfile.TemporaryDirectory() as root_dir:
+        static_files_dir = os.path.join(root_dir, "static_files")
+        logo_path = os.path.join(static_files_dir, write_logo(static_files_dir, (100, 100)))
+        rendered = icons.render_icons(logo_path, os.path.join(root_dir, "cache"))
+        assert "180, 192, 512 pixel icons are scaled up" in capsys.readouterr().out
+        with Image.open(io.BytesIO(rendered[512])) as icon:
+            assert icon.size == (512, 512)
@@ -0,0 +1,19 @@
+import io
+import os
+import tempfile
+
+from log_utils import copy_to_log, tail_lines
+
+
+def test_tail_lines_across_rotated_logs():
+    with tempfile.TemporaryDirectory() as root_dir:
+        path = os.path.join(root_dir, "prod_log.txt")
+        output = b"".join(f"{'web_1' if i % 2 else 'db_1 '}  | line {i}\n".encode() for i in range(10000))
+        copy_to_log(io.BytesIO(output), path, max_bytes=20000, backup_count=3)
+        assert sorted(os.listdir(root_dir)) == ["prod_log.txt", "prod_log.txt.1", "prod_log.txt.2", "prod_log.txt.3"]
+        assert all(os.path.getsize(os.path.join(root_dir, filename)) <= 20000 for filename in os.listdir(root_dir))
+        assert tail_lines(path, 2) == ["db_1   | line 9998", "web_1  | line 9999"]
+        assert tail_lines(path, 2, service="db", pattern="0$") == ["db_1   | line 9980", "db_1   | line 9990"]
+        lines = tail_lines(path, 100000)
+        assert lines[-1] == "web_1  | line 9999"
+        assert lines == [f"{'web_1' if i % 2 else 'db_1 '}  | line {i}" for i in range(10000 - len(lines), 10000)]
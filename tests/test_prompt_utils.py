@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+from prompt_toolkit.document import Document
+
+from prompt_utils import DirectoryIndex, FilePathCompleter, rank_matches
+
+
+def test_rank_matches():
+    candidates = ["images/album/logo_old.png", "images/taktlauslogo.svg", "logo.svg", "images/lots/of/goats.png"]
+    assert rank_matches("logo", candidates, 10) == ["logo.svg", "images/album/logo_old.png", "images/taktlauslogo.svg", "images/lots/of/goats.png"]
+    assert rank_matches("tlogo", candidates, 10)[0] == "images/taktlauslogo.svg"
+    assert rank_matches("logo", candidates, 2) == ["logo.svg", "images/album/logo_old.png"]
+    assert rank_matches("xyz", candidates, 10) == []
+
+
+def test_file_path_completer_sees_new_files():
+    with tempfile.TemporaryDirectory() as root_dir:
+        os.makedirs(os.path.join(root_dir, "images"))
+        open(os.path.join(root_dir, "images", "logo.svg"), "w").close()
+        completer = FilePathCompleter(start_dir=root_dir, recursive=True)
+        completer.index.max_age = 0
+        complete = lambda text: [completion.text for completion in completer.get_completions(Document(text), None)]
+        assert complete("logo") == ["images/logo.svg"]
+        open(os.path.join(root_dir, "images", "logo.png"), "w").close()
+        os.utime(os.path.join(root_dir, "images"), ns=(0, 0))
+        assert complete("logo") == ["images/logo.png", "images/logo.svg"]
+
+
+def test_directory_index_does_not_follow_symlink_loops():
+    with tempfile.TemporaryDirectory() as root_dir:
+        os.makedirs(os.path.join(root_dir, "images"))
+        with open(os.path.join(root_dir, "images", "logo.svg"), "w") as file:
+            file.write("<svg/>")
+        os.symlink(root_dir, os.path.join(root_dir, "images", "loop"))
+        assert DirectoryIndex().walk(root_dir) == [os.path.join("images", "logo.svg")]
@@ -0,0 +1,71 @@
+import os
+import tempfile
+
+import pytest
+
+from image_fingerprints import load_fingerprints, save_fingerprints
+from provision import load_sites
+
+
+def write_manifest(root_dir, content):
+    path = os.path.join(root_dir, "manifests", "sites.toml")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(content)
+    return path
+
+
+def test_load_sites_merges_defaults_and_resolves_paths():
+    with tempfile.TemporaryDirectory() as root_dir:
+        manifest_dir = os.path.join(root_dir, "manifests")
+        manifest_file = write_manifest(root_dir, "\n".join([
+            "[defaults]",
+            'output_dir = "../sites"',
+            'link_mode = "copy"',
+            "",
+            "[[site]]",
+            'name = "taktlaus"',
+            'config_file = "taktlaus/config.toml"',
+            "production = true",
+            "",
+            "[[site]]",
+            'name = "taktfull"',
+            'website_build_dir = "/srv/taktfull/website_build"',
+            'link_mode = "hardlink"',
+            "dev_data = true",
+        ]))
+        taktlaus, taktfull = load_sites(manifest_file)
+        assert taktlaus["config_file"] == os.path.join(manifest_dir, "taktlaus/config.toml")
+        assert taktlaus["website_build_dir"] == os.path.join(manifest_dir, "../sites", "taktlaus", "website_build")
+        assert taktlaus["link_mode"] == "copy"
+        assert taktlaus["production"] and not taktlaus["reset_database"]
+        assert "dev_data" not in taktlaus
+        assert taktfull["website_build_dir"] == "/srv/taktfull/website_build"
+        assert taktfull["link_mode"] == "hardlink"
+        assert not taktfull["production"] and taktfull["dev_data"]
+        assert "config_file" not in taktfull
+
+
+@pytest.mark.parametrize("sites", [
+    ['name = "Taktlaus"'],
+    ['name = "-taktlaus"'],
+    ['name = "takt laus"'],
+    ["name = 1"],
+    ['config_file = "config.toml"'],
+    ['name = "taktlaus"', 'dev_data = "yes"'],
+    ['name = "taktlaus"', "[[site]]", 'name = "taktlaus"'],
+])
+def test_load_sites_rejects_invalid_sites(sites):
+    with tempfile.TemporaryDirectory() as root_dir:
+        manifest_file = write_manifest(root_dir, "\n".join(["[[site]]", *sites]))
+        with pytest.raises(ValueError):
+            load_sites(manifest_file)
+
+
+def test_fingerprints_are_stored_per_key():
+    with tempfile.TemporaryDirectory() as cache_dir:
+        save_fingerprints("/srv/a/docker-compose.prod.yaml:mytaktlausvev_a", {"django": "1"}, cache_dir)
+        save_fingerprints("/srv/b/docker-compose.prod.yaml:mytaktlausvev_b", {"django": "2"}, cache_dir)
+        assert load_fingerprints("/srv/a/docker-compose.prod.yaml:mytaktlausvev_a", cache_dir) == {"django": "1"}
+        assert load_fingerprints("/srv/b/docker-compose.prod.yaml:mytaktlausvev_b", cache_dir) == {"django": "2"}
+        assert load_fingerprints("/srv/c/docker-compose.prod.yaml", cache_dir) == {}
@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+# Import time budgets in seconds for every entry point, on top of the bare
+# interpreter. They are generous, so that only a heavy dependency slipping back
+# into module level makes them fail, and not a slow machine.
+STARTUP_BUDGETS = {
+    "prod": 0.3,
+    "build_website": 0.5,
+    "wizard": 1.5,
+    "icons": 1.0,
+}
+# Modules that must not be loaded just by importing an entry point.
+LAZY_MODULES = {
+    "prod": ["build_website", "prompt_toolkit", "tomlkit", "yaml", "PIL", "urllib.request"],
+    "build_website": ["PIL", "prompt_toolkit", "validators"],
+    "wizard": ["PIL", "svglib", "reportlab"],
+}
+
+
+def run_python(code):
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=r("../"),
+        stdout=subprocess.PIPE,
+        check=True,
+        text=True,
+    ).stdout
+
+
+def import_time(module, repeat=5):
+    """
+    Returns the shortest wall time of `repeat` fresh interpreters importing `module`, minus that of a bare interpreter.
+    """
+    def fastest(code):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run_python(code)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return max(0, fastest(f"import {module}") - fastest("pass"))
+
+
+def test_entry_points_load_dependencies_lazily():
+    for module, lazy_modules in LAZY_MODULES.items():
+        loaded = json.loads(run_python(f"import json, sys, {module}; print(json.dumps(list(sys.modules)))"))
+        assert [lazy_module for lazy_module in lazy_modules if lazy_module in loaded] == [], module
+
+
+def test_startup_budget():
+    for module, budget in STARTUP_BUDGETS.items():
+        seconds = import_time(module)
+        assert seconds <= budget, f"Importing {module} took {seconds * 1000:.0f} ms, the budget is {budget * 1000:.0f} ms"
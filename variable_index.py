@@ -0,0 +1,157 @@
+import hashlib
+import io
+import json
+import os
+import re
+
+
+TEMPLATE_EXTENSIONS = [".py", ".html", ".scss", ".js", ".md", ".conf", ".env", ".json"]
+VARIABLE_MARKER = "(MYTAKTLAUSVEV_VARIABLE("
+VARIABLE_PATTERN = re.compile(r"\(MYTAKTLAUSVEV_VARIABLE\((.+?)\)\)")
+INDEX_VERSION = 1
+
+
+def r(*path):
+    """
+    Takes a relative path from the directory of this python file and returns the absolute path.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), *path)
+
+
+CACHE_DIR = r(".mytaktlausvev_cache")
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def decode_template(data):
+    """
+    Decodes `data` exactly like `open(path, "r").read()` would, so that marker offsets match the text the build reads.
+    """
+    return io.TextIOWrapper(io.BytesIO(data)).read()
+
+
+def find_markers(template):
+    """
+    Returns `[start, end, variable]` for every `(MYTAKTLAUSVEV_VARIABLE(variable))` in `template`.
+    """
+    if VARIABLE_MARKER not in template:
+        return []
+    return [[match.start(), match.end(), match.group(1)] for match in VARIABLE_PATTERN.finditer(template)]
+
+
+def default_index_path(root_dir, cache_dir=CACHE_DIR):
+    root_dir_hash = hashlib.sha256(os.path.abspath(root_dir).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, "variable_index", f"{root_dir_hash}.json")
+
+
+class VariableIndex:
+    """
+    Persistent index of every file in `root_dir` and the config variable markers in it.
+
+    Files are only rehashed when their size or mtime changed, and only rescanned for markers when their hash changed.
+    """
+    def __init__(self, root_dir, index_path=None):
+        self.root_dir = root_dir
+        self.index_path = index_path or default_index_path(root_dir)
+        self.entries = {}
+        self.changed = False
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        if index.get("version") == INDEX_VERSION and index.get("root_dir") == os.path.abspath(root_dir):
+            self.entries = index["files"]
+
+    def refresh(self):
+        entries = {}
+        for dirpath, dirnames, filenames in os.walk(self.root_dir, followlinks=True):
+            for filename in filenames:
+                file_path = os.path.join(dirpath, filename)
+                path = os.path.relpath(file_path, self.root_dir)
+                entries[path] = self.refresh_entry(path, file_path, self.entries.get(path))
+        if entries.keys() != self.entries.keys():
+            self.changed = True
+        self.entries = entries
+        return self
+
+    def refresh_entry(self, path, file_path, entry):
+        stat = os.stat(file_path)
+        if entry is not None and (entry["size"], entry["mtime_ns"]) == (stat.st_size, stat.st_mtime_ns):
+            return entry
+        self.changed = True
+        with open(file_path, "rb") as file:
+            data = file.read()
+        source_hash = hash_bytes(data)
+        if entry is not None and entry["hash"] == source_hash:
+            markers = entry["markers"]
+        elif os.path.splitext(path)[1] in TEMPLATE_EXTENSIONS:
+            markers = find_markers(decode_template(data))
+        else:
+            markers = []
+        return {
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "hash": source_hash,
+            "markers": markers,
+        }
+
+    def save(self):
+        if not self.changed:
+            return
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        temporary_path = f"{self.index_path}.tmp{os.getpid()}"
+        with open(temporary_path, "w") as file:
+            json.dump({
+                "version": INDEX_VERSION,
+                "root_dir": os.path.abspath(self.root_dir),
+                "files": self.entries,
+            }, file)
+        os.replace(temporary_path, self.index_path)
+        self.changed = False
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def hash(self, path):
+        return self.entries[path]["hash"]
+
+    def markers(self, path):
+        return self.entries[path]["markers"]
+
+    def variables(self, path):
+        return list(dict.fromkeys(variable for _, _, variable in self.markers(path)))
+
+    def occurrences(self, variable):
+        """
+        Returns `(path, start, end)` for every marker referencing `variable`.
+        """
+        return [
+            (path, start, end)
+            for path, entry in self.entries.items()
+            for start, end, marker_variable in entry["markers"]
+            if marker_variable == variable
+        ]
+
+    def files_using(self, variable):
+        return list(dict.fromkeys(path for path, _, _ in self.occurrences(variable)))
+
+    def counts(self):
+        counts = {}
+        for entry in self.entries.values():
+            for _, _, variable in entry["markers"]:
+                counts[variable] = counts.get(variable, 0) + 1
+        return counts
@@ -0,0 +1,171 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+INOTIFY_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """
+    Detects changes by comparing the size and mtime of every file under `paths` every `interval` seconds.
+
+    `paths` can be directories, which are watched recursively, or single files, which may also not exist yet.
+    """
+    def __init__(self, paths, interval=0.5):
+        self.paths = paths
+        self.interval = interval
+        self.state = self.scan()
+
+    def scan(self):
+        state = {}
+        for path in self.paths:
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                    for filename in filenames:
+                        self.stat(os.path.join(dirpath, filename), state)
+            else:
+                self.stat(path, state)
+        return state
+
+    def stat(self, path, state):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        state[path] = (stat.st_size, stat.st_mtime_ns)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until something changes or `timeout` seconds have passed, and returns the set of changed paths.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self.scan()
+            changed = {
+                path
+                for path in state.keys() | self.state.keys()
+                if state.get(path) != self.state.get(path)
+            }
+            self.state = state
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else min(self.interval, max(0, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """
+    Detects changes with Linux inotify, through ctypes so that no extra dependency is needed.
+
+    Directories are watched recursively. Single files are watched through their parent directory, so that editors replacing the file on save are noticed too.
+    """
+    def __init__(self, paths):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watch_dirs = {}
+        self.files = set()
+        for path in paths:
+            if os.path.isdir(path):
+                for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                    self.add_watch(dirpath, recursive=True)
+            else:
+                self.files.add(os.path.abspath(path))
+                self.add_watch(os.path.dirname(os.path.abspath(path)), recursive=False)
+
+    def add_watch(self, directory, recursive):
+        watch_descriptor = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), INOTIFY_MASK)
+        if watch_descriptor < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        previous = self.watch_dirs.get(watch_descriptor)
+        self.watch_dirs[watch_descriptor] = (directory, recursive or (previous is not None and previous[1]))
+
+    def wait(self, timeout=None):
+        """
+        Blocks until something changes or `timeout` seconds have passed, and returns the set of changed paths.
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                watch_descriptor, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                name = os.fsdecode(data[offset:offset + name_length].rstrip(b"\0"))
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    changed.update(directory for directory, _ in self.watch_dirs.values())
+                    continue
+                if watch_descriptor not in self.watch_dirs:
+                    continue
+                directory, recursive = self.watch_dirs[watch_descriptor]
+                path = os.path.join(directory, name) if name else directory
+                if not recursive and path not in self.files:
+                    continue
+                if recursive and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                    for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                        self.add_watch(dirpath, recursive=True)
+                        changed.update(os.path.join(dirpath, filename) for filename in filenames)
+                changed.add(path)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def create_watcher(paths, polling=False):
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError) as exception:
+            print(f"Could not watch with inotify ({exception}), falling back to polling")
+    return PollingWatcher(paths)
+
+
+def watch(paths, callback, debounce=0.2, polling=False):
+    """
+    Calls `callback` with the set of changed paths every time something under `paths` changes, until interrupted with Ctrl+C.
+
+    Changes arriving less than `debounce` seconds apart, like an editor saving several files at once, are collected into a single call.
+    """
+    watcher = create_watcher(paths, polling=polling)
+    try:
+        while True:
+            changed = watcher.wait()
+            while True:
+                more = watcher.wait(timeout=debounce)
+                if not more:
+                    break
+                changed |= more
+            callback(changed)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
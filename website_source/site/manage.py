@@ -0,0 +1 @@
+x = "(MYTAKTLAUSVEV_VARIABLE(nope))"
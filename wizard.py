@@ -2,7 +2,6 @@
 
 import argparse
 import inspect
-import io
 import os
 import subprocess
 import time
@@ -11,15 +10,13 @@ import tomlkit
 import random
 import string
 
-from PIL import Image
-from svglib.svglib import svg2rlg
-from reportlab.graphics import renderPM
-
 from create_config import create_config, HighLevelConfigEntry
 from build_website import build_website
 import prompt_utils
 from build_website import TomlDict
+from config_schema import ConfigError
 from prod import prod_start
+from provision import set_up_production
 
 
 def r(*path):
@@ -37,27 +34,26 @@ def run_in_dir(directory, callable):
     return result
 
 
-def convert_to_ico(logo_path):
-    static_files_dir_path = r("static_files")
-    ico_path = f"{os.path.splitext(logo_path)[0]}.ico"
+def logo_icons(logo_path):
+    """
+    Generates the favicon and the Apple touch icon from the logo, and returns the config options pointing to them.
+    """
     try:
-        with open(os.path.join(static_files_dir_path, logo_path), "rb") as file:
-            logo = io.BytesIO(file.read())
-        if os.path.splitext(logo_path)[1] == ".svg":
-                drawing = svg2rlg(logo)
-                logo = io.BytesIO()
-                renderPM.drawToFile(drawing, logo, fmt="PNG")
-        Image.open(
-            logo
-        ).save(
-            os.path.join(static_files_dir_path, ico_path)
-        )
+        from icons import generate_icons
+
+        icons = generate_icons(logo_path, r("static_files"))
     except Exception as exception:
         print(exception)
-        print("Logoen kunne ikkje konverterast automatisk til .ico-fil.")
-        print(f"Du må difor konvertere til den til ei .ico-fil på eiga hand og leggje ho inn med filstien {os.path.join(static_files_dir_path, ico_path)}.")
-        print("Du kan fullføre trollmannen før du gjer dette.")
-    return ico_path
+        print("Logoen kunne ikkje konverterast automatisk til ikon.")
+        print(f"Du må difor lage ikona på eiga hand, eller køyre ./icons.py {logo_path} når problemet er løyst.")
+        print("Du kan fullføre trollmannen før du gjer dette. Inntil da blir favikonet til taktlausveven brukt.")
+        return {
+            "appearance.manifest.apple_touch_icon": logo_path,
+        }
+    return {
+        "appearance.manifest.apple_touch_icon": icons["apple_touch_icon"],
+        "appearance.favicon": icons["favicon"],
+    }
 
 
 config_entries = [
@@ -96,8 +92,7 @@ config_entries = [
         "Logo",
         lambda logo_path: {
             "appearance.navbar.logo": logo_path,
-            "appearance.manifest.apple_touch_icon": logo_path,
-            "appearance.favicon": convert_to_ico(logo_path),
+            **logo_icons(logo_path),
         },
         validator=prompt_utils.FilePathIsFileValidator(start_dir=r("static_files")),
         completer=prompt_utils.FilePathCompleter(start_dir=r("static_files"), recursive=True),
@@ -170,10 +165,10 @@ def wizard(config_file=None, server_secrets_file=None):
     print("Du kan når som helst avbryte meg med Ctrl+C.")
     config_file_path = config_file or create_config(prompt_session, config_entries, "config.toml")
     with open(config_file_path, "r") as file:
-        config = TomlDict(tomlkit.load(file))
+        config = TomlDict(tomlkit.load(file)).snapshot()
     server_secrets_file_path = server_secrets_file or create_config(prompt_session, server_secrets_entries, "server_secrets.toml")
     with open(server_secrets_file_path, "r") as file:
-        server_secrets = TomlDict(tomlkit.load(file))
+        server_secrets = TomlDict(tomlkit.load(file)).snapshot()
     if server_secrets["production.hosting_solution"] == "server":
         print("Er dette den serveren du faktisk skal hoste nettsida på?")
         production = prompt_session.prompt_yes_no()
@@ -189,16 +184,16 @@ def wizard(config_file=None, server_secrets_file=None):
         build = True
         reset_database = True
     if build:
-        build_website([r("taktlausconfig.toml"), config_file_path, server_secrets_file_path])
+        try:
+            build_website([r("taktlausconfig.toml"), config_file_path, server_secrets_file_path])
+        except ConfigError as exception:
+            print("Konfigurasjonen er ikkje gyldig:")
+            for error in exception.errors:
+                print(f"  {error}")
+            print(f"Rett opp i {config_file_path} og {server_secrets_file_path}, og køyr trollmannen på nytt med --config-file og --server-secrets-file.")
+            return
     if production:
-        def f():
-            subprocess.run(f'docker-compose -f docker-compose.prod.yaml down {"-v" if reset_database else ""} --remove-orphans', shell=True)
-            subprocess.run("docker-compose -f docker-compose.prod.yaml build", shell=True)
-            subprocess.run("docker-compose -f docker-compose.prod.yaml run --rm django python site/manage.py migrate", shell=True)
-            if reset_database:
-                subprocess.run("docker-compose -f docker-compose.prod.yaml run --rm django site/manage.py mytaktlausvev_create_initial_data", shell=True)
-            subprocess.run("docker-compose -f docker-compose.prod.yaml down", shell=True)
-        run_in_dir(r("website_build"), f)
+        set_up_production(r("website_build"), reset_database, force_build=build)
     else:
         print("Vi setter nå opp ein lokal utviklingsversjon av vevsida di.")
         print("Vil du ha utviklingsdata i databasen? Dette gjer at sida vil føles mykje mindre tom.")